@@ -1,13 +1,33 @@
 from __future__ import annotations
 
+import gzip
+import hashlib
+import inspect
 import json
+import os
 import math
 import re
+import threading
+import time
 from collections import defaultdict, deque
 from pathlib import Path
 from uuid import uuid4
 
-from flask import Flask, flash, redirect, render_template, request, session, url_for
+import click
+from flask import Flask, abort, flash, g, jsonify, redirect, render_template, request, send_file, session, url_for
+from markupsafe import Markup
+
+from auth import AuthBusy, passwords
+from cache import BoundedCache, SharedCache
+from history import (FamilyHistory, VersionNotFound, family_changes_response, family_json_response,
+                     identity as history_identity)
+from images import THUMB_MANIFEST, ThumbnailPipeline
+from jobs import JobQueue, run_workers, task
+from metrics import REGISTRY, instrument, timed
+from model import CompactFamily, ConnectorList, PlacedPerson
+from profiler import attach_slow_request_profiler
+from publish import Publisher, remove_snapshot
+from storage import ensure_dir, init_marker_matches, migrate_to_shards, shard_dir, write_init_marker
 
 BASE_DIR = Path(__file__).resolve().parent
 DATA_DIR = BASE_DIR / 'data'
@@ -15,12 +35,54 @@ USERS_PATH = DATA_DIR / 'users.json'
 DEMO_FAMILY_PATH = DATA_DIR / 'kennedy.json'
 MARKETING_PATH = DATA_DIR / 'family.json'
 USER_FAMILIES_DIR = DATA_DIR / 'user_families'
-USER_FAMILIES_DIR.mkdir(exist_ok=True)
+PUBLIC_DIR = BASE_DIR / 'static' / 'public'
+EXPORTS_DIR = DATA_DIR / 'exports'
+
+TREE_LAYOUT = {
+    'unit_width': 192,
+    'pair_gap': 12,
+    'generation_gap': 206,
+    'card_width': 82,
+    'pair_card_width': 82,
+    'card_height': 128,
+    'row_padding_x': 48,
+    'row_padding_y': 28,
+}
+TREE_LAYOUT_KEY = tuple(sorted(TREE_LAYOUT.items()))
+
+THUMBNAILS = ThumbnailPipeline(BASE_DIR / 'static')
+
+# Parsed family files held compactly (model.CompactFamily), keyed by path and checked against the file version.
+FAMILY_CACHE = BoundedCache('families', max_entries=4096, max_bytes=256 * 1024 * 1024,
+                            sizeof=lambda entry: entry[1].approx_size())
+
+# Rendered _tree_canvas.html fragments, keyed by family file version + layout parameters.
+CANVAS_CACHE = BoundedCache('tree_canvas', max_entries=512, max_bytes=64 * 1024 * 1024)
+
+# Computed tree layouts, same keys; the per-worker front of SHARED_CACHE.
+LAYOUT_CACHE = BoundedCache('tree_layouts', max_entries=512, max_bytes=128 * 1024 * 1024,
+                            sizeof=lambda tree: 300 * len(tree['people']) + 40 * len(tree['connectors']))
+
+# Layouts and canvas fragments shared by every worker and job process on this host.
+SHARED_CACHE = SharedCache('shared', DATA_DIR / 'cache.db',
+                           max_bytes=int(os.environ.get('LINEAGEMAP_SHARED_CACHE_MB', '256')) * 1024 * 1024)
 
 app = Flask(__name__)
 app.secret_key = 'lineagemap-dev-secret'
+instrument(app)
+attach_slow_request_profiler(app, DATA_DIR)
+REGISTRY.register_cache(CANVAS_CACHE)
+REGISTRY.register_cache(FAMILY_CACHE)
+REGISTRY.register_cache(LAYOUT_CACHE)
+REGISTRY.register_cache(SHARED_CACHE)
+REGISTRY.register_cache(THUMB_MANIFEST)
 
+JOBS = JobQueue(DATA_DIR / 'jobs.db')
+HISTORY = FamilyHistory(DATA_DIR / 'history.db')
+JOB_KINDS = ('layout', 'thumbnails', 'export')
 
+
+@timed('json_load')
 def load_json(path: Path, default=None):
     if not path.exists():
         return {} if default is None else default
@@ -29,9 +91,16 @@ def load_json(path: Path, default=None):
 
 
 def save_json(path: Path, payload: dict) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open('w', encoding='utf-8') as f:
-        json.dump(payload, f, indent=2)
+    # Write-then-rename so other workers never read a half-written users.json or family file.
+    ensure_dir(path.parent)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with tmp.open('w', encoding='utf-8') as f:
+            json.dump(payload, f, indent=2)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
 
 
 def slugify(value: str) -> str:
@@ -39,10 +108,38 @@ def slugify(value: str) -> str:
     return cleaned.strip('_') or f'person_{uuid4().hex[:6]}'
 
 
+_users_cache: dict = {'version': None, 'data': None}
+
+
 def get_users() -> dict:
-    return load_json(USERS_PATH, default={'users': []})
+    # users.json is re-read only when its mtime/size changes.
+    version = family_version(USERS_PATH)
+    if version is None or _users_cache['version'] != version:
+        _users_cache['data'] = load_json(USERS_PATH, default={'users': []})
+        _users_cache['version'] = version
+    return _users_cache['data']
 
 
+def set_user_password_hash(username: str, password_hash: str) -> None:
+    users = load_json(USERS_PATH, default={'users': []})
+    for user in users.get('users', []):
+        if user.get('username') == username:
+            user['password_hash'] = password_hash
+            user.pop('password', None)
+    save_json(USERS_PATH, users)
+
+
+def verify_login(user: dict, password: str) -> bool:
+    if user.get('password_hash'):
+        ok, upgraded = passwords.verify_and_upgrade(user['password_hash'], password)
+    else:
+        ok, upgraded = passwords.verify_legacy_plaintext(user.get('password', ''), password)
+    if ok and upgraded:
+        set_user_password_hash(user['username'], upgraded)
+    return ok
+
+
+@timed('user_lookup')
 def get_user(username: str) -> dict | None:
     for user in get_users().get('users', []):
         if user.get('username') == username:
@@ -58,37 +155,104 @@ def current_user() -> dict | None:
 
 
 def user_family_path(username: str) -> Path:
-    return USER_FAMILIES_DIR / f'{username}.json'
+    return shard_dir(USER_FAMILIES_DIR, username) / f'{username}.json'
+
+
+def family_version(path: Path) -> str | None:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return f'{st.st_mtime_ns:x}-{st.st_size:x}'
+
+
+def load_family(path: Path) -> dict:
+    version = family_version(path)
+    if version is None:
+        return {}
+    cached = FAMILY_CACHE.get(str(path))
+    if cached is None or cached[0] != version:
+        cached = (version, CompactFamily.from_json(load_json(path, default={})))
+        FAMILY_CACHE.put(str(path), cached)
+    return cached[1].to_json()
 
 
 def load_marketing_data() -> dict:
     return load_json(MARKETING_PATH, default={})
 
 
+def user_family_source(username: str) -> tuple[dict, Path]:
+    """
+    The user's family and the file its people/relationships come from.
+
+    New accounts are copy-on-write: until their first save they read the shared demo family
+    (parsed, laid out and rendered once for everyone) under a per-user meta block, and nothing
+    is written. save_user_family() materializes the user's own file.
+    """
+    path = user_family_path(username)
+    family = load_family(path)
+    if family:
+        return family, path
+    demo = load_family(DEMO_FAMILY_PATH)
+    seeded = {
+        'meta': {
+            'family_name': f"{username.title()} Family",
+            'owner_username': username,
+            'profile_name': username.title(),
+            'profile_photo': '/static/img/you.jpg',
+            'description': 'Start with the sample tree, then add your own relatives.'
+        },
+        'people': demo.get('people', []),
+        'relationships': demo.get('relationships', []),
+        'events': demo.get('events', []),
+    }
+    return seeded, DEMO_FAMILY_PATH
+
+
 def ensure_user_family(username: str) -> dict:
+    return user_family_source(username)[0]
+
+
+def user_family_with_version(username: str) -> tuple[dict, int]:
+    # Copy-on-write accounts read the demo file live and pre-history files can be edited by hand, so the
+    # version follows the source file too, not only saves.
+    family, path = user_family_source(username)
+    return family, HISTORY.current(username, (str(path), family_version(path)), family)
+
+
+def save_user_family(username: str, payload: dict, message: str = '') -> None:
     path = user_family_path(username)
-    if not path.exists():
-        demo = load_json(DEMO_FAMILY_PATH, default={})
-        seeded = {
-            'meta': {
-                'family_name': f"{username.title()} Family",
-                'owner_username': username,
-                'profile_name': username.title(),
-                'profile_photo': '/static/img/you.jpg',
-                'description': 'Start with the sample tree, then add your own relatives.'
-            },
-            'people': demo.get('people', []),
-            'relationships': demo.get('relationships', []),
-            'events': demo.get('events', []),
-        }
-        save_json(path, seeded)
-    return load_json(path, default={})
+    if HISTORY.latest(username) is None:
+        # First recorded save: keep what the family looked like before it (shared base or pre-history file).
+        HISTORY.record(username, ensure_user_family(username), 'Initial version')
+    save_json(path, payload)
+    HISTORY.record(username, payload, message)
+    # Versions already change with the file; dropping the rows just frees the space early.
+    SHARED_CACHE.discard(f'layout:{path}')
+    SHARED_CACHE.discard(f'canvas:{path}')
+    if payload.get('meta', {}).get('is_public') or public_snapshot_dir(username).exists():
+        PUBLISHER.schedule(username)
 
 
-def save_user_family(username: str, payload: dict) -> None:
-    save_json(user_family_path(username), payload)
+def public_slug(username: str) -> str:
+    # slugify alone maps e.g. "a.b" and "a_b" to the same directory; the hash keeps users apart.
+    return f"{slugify(username)}-{hashlib.sha1(username.encode('utf-8')).hexdigest()[:8]}"
 
 
+def public_snapshot_dir(username: str) -> Path:
+    return PUBLIC_DIR / public_slug(username)
+
+
+def public_family_payload(family: dict) -> dict:
+    return {
+        'meta': {'family_name': family.get('meta', {}).get('family_name', 'Family Tree')},
+        'people': family.get('people', []),
+        'relationships': family.get('relationships', []),
+        'events': family.get('events', []),
+    }
+
+
+@timed('stats')
 def family_stats(data: dict) -> dict:
     people = data.get('people', [])
     relationships = data.get('relationships', [])
@@ -123,7 +287,8 @@ def family_stats(data: dict) -> dict:
     }
 
 
-def build_tree_layout(data: dict) -> dict:
+@timed('layout')
+def build_tree_layout(data: dict, generate_thumbs: bool = False) -> dict:
     people = {person['id']: person for person in data.get('people', [])}
     relationships = data.get('relationships', [])
     spouse_map: dict[str, str] = {}
@@ -195,17 +360,16 @@ def build_tree_layout(data: dict) -> dict:
             for pid in unit:
                 unit_index_by_person[pid] = (gen, idx)
 
-    layout_people = []
-    connectors = []
+    layout_people: list[PlacedPerson] = []
+    connectors = ConnectorList()
 
-    unit_width = 192
-    pair_gap = 12
-    generation_gap = 206
-    card_width = 82
-    pair_card_width = 82
-    card_height = 128
-    row_padding_x = 48
-    row_padding_y = 28
+    unit_width = TREE_LAYOUT['unit_width']
+    pair_gap = TREE_LAYOUT['pair_gap']
+    generation_gap = TREE_LAYOUT['generation_gap']
+    card_width = TREE_LAYOUT['card_width']
+    pair_card_width = TREE_LAYOUT['pair_card_width']
+    row_padding_x = TREE_LAYOUT['row_padding_x']
+    row_padding_y = TREE_LAYOUT['row_padding_y']
 
     max_units = max((len(units) for units in units_by_gen.values()), default=1)
     canvas_width = max(720, row_padding_x * 2 + max_units * unit_width)
@@ -226,13 +390,7 @@ def build_tree_layout(data: dict) -> dict:
                 second_x = first_x + pair_card_width + pair_gap
                 positions = [(unit[0], first_x), (unit[1], second_x)]
                 couple_center = (first_x + pair_card_width / 2 + second_x + pair_card_width / 2) / 2
-                connectors.append({
-                    'type': 'spouse',
-                    'x1': first_x + pair_card_width,
-                    'y1': y + 58,
-                    'x2': second_x,
-                    'y2': y + 58,
-                })
+                connectors.append('spouse', first_x + pair_card_width, y + 58, second_x, y + 58)
                 unit_centers[(gen, idx)] = couple_center
             else:
                 single_x = unit_start_x + (unit_width - card_width) / 2
@@ -241,15 +399,17 @@ def build_tree_layout(data: dict) -> dict:
 
             for pid, x in positions:
                 person = people[pid]
-                layout_people.append({
-                    'id': pid,
-                    'name': person['name'],
-                    'years': f"{person.get('born', '')}-{person.get('died', '')}".strip('-'),
-                    'photo': person.get('photo', '/static/img/you.jpg'),
-                    'x': round(x, 1),
-                    'y': round(y, 1),
-                    'generation': gen,
-                })
+                photo = person.get('photo', '/static/img/you.jpg')
+                layout_people.append(PlacedPerson(
+                    id=pid,
+                    name=person['name'],
+                    years=f"{person.get('born', '')}-{person.get('died', '')}".strip('-'),
+                    photo=photo,
+                    thumb=THUMBNAILS.thumbnails_for(photo) if generate_thumbs else THUMBNAILS.lookup(photo),
+                    x=round(x, 1),
+                    y=round(y, 1),
+                    generation=gen,
+                ))
 
     sibling_connectors: dict[tuple[int, int], list[float]] = defaultdict(list)
 
@@ -269,20 +429,14 @@ def build_tree_layout(data: dict) -> dict:
         bus_y = (parent_y + child_y) / 2
 
         sibling_connectors[parent_unit].append(child_center_x)
-        connectors.append({'type': 'parent-drop', 'x1': parent_center_x, 'y1': parent_y, 'x2': parent_center_x, 'y2': bus_y})
-        connectors.append({'type': 'child-drop', 'x1': child_center_x, 'y1': bus_y, 'x2': child_center_x, 'y2': child_y})
+        connectors.append('parent-drop', parent_center_x, parent_y, parent_center_x, bus_y)
+        connectors.append('child-drop', child_center_x, bus_y, child_center_x, child_y)
 
     for parent_unit, child_centers in sibling_connectors.items():
         if not child_centers:
             continue
         bus_y = (row_padding_y + parent_unit[0] * generation_gap + 160 + row_padding_y + (parent_unit[0] + 1) * generation_gap) / 2
-        connectors.append({
-            'type': 'sibling-bus',
-            'x1': min(child_centers),
-            'y1': bus_y,
-            'x2': max(child_centers),
-            'y2': bus_y,
-        })
+        connectors.append('sibling-bus', min(child_centers), bus_y, max(child_centers), bus_y)
 
     return {
         'family_name': data.get('meta', {}).get('family_name', 'Family Tree'),
@@ -293,9 +447,182 @@ def build_tree_layout(data: dict) -> dict:
         'people': layout_people,
         'connectors': connectors,
         'stats': family_stats(data),
+        # Portraits still being thumbnailed in the background render from the original photo meanwhile.
+        'thumbs_pending': any(p.thumb is None and not THUMBNAILS.ready(p.photo) for p in layout_people),
     }
 
 
+def layout_to_json(tree: dict) -> dict:
+    return dict(tree, people=[person.to_json() for person in tree['people']], connectors=tree['connectors'].to_json())
+
+
+def layout_from_json(data: dict) -> dict:
+    return dict(data, people=[PlacedPerson.from_json(person) for person in data['people']],
+                connectors=ConnectorList.from_json(data['connectors']))
+
+
+def tree_layout(path: Path, family: dict) -> dict:
+    version = family_version(path)
+    if version is None:
+        return build_tree_layout(family)
+    meta = family.get('meta', {})
+    key = (str(path), version, TREE_LAYOUT_KEY)
+    tree = LAYOUT_CACHE.get(key)
+    if tree is None:
+        shared_version = f'{version}:{layout_cache_tag()}'
+        cached = SHARED_CACHE.get(f'layout:{path}', shared_version)
+        if cached is not None:
+            tree = layout_from_json(json.loads(cached))
+        else:
+            tree = build_tree_layout(family)
+            SHARED_CACHE.put(f'layout:{path}', shared_version, json.dumps(layout_to_json(tree), separators=(',', ':')))
+        LAYOUT_CACHE.put(key, tree)
+    if tree.get('thumbs_pending'):
+        # The layout may come from another worker's build; readiness is read from the on-disk thumbnail
+        # manifest, and photos still missing are queued here too in case no process is generating them.
+        waiting = [p.photo for p in tree['people'] if p.thumb is None and not THUMBNAILS.ready(p.photo)]
+        for photo in waiting:
+            THUMBNAILS.queue(photo)
+        if not waiting:
+            tree = dict(tree, thumbs_pending=False, people=[
+                PlacedPerson.from_json(dict(p.to_json(), thumb=p.thumb or THUMBNAILS.lookup(p.photo)))
+                for p in tree['people']
+            ])
+            SHARED_CACHE.put(f'layout:{path}', f'{version}:{layout_cache_tag()}',
+                             json.dumps(layout_to_json(tree), separators=(',', ':')))
+            LAYOUT_CACHE.put(key, tree)
+    # Copy-on-write families share the sample's cached layout, so the header always comes from the caller's meta.
+    return dict(
+        tree,
+        family_name=meta.get('family_name', 'Family Tree'),
+        profile_name=meta.get('profile_name', ''),
+        profile_photo=meta.get('profile_photo', '/static/img/you.jpg'),
+    )
+
+
+# data/cache.db outlives deploys, so shared entries are versioned by the code and template that
+# produced them (hashed on first use, so importing the app stays free of file reads).
+_cache_tags: dict = {'layout': None, 'canvas': None}
+
+
+def _source_hash(*sources: str) -> str:
+    return hashlib.sha1('\n'.join(sources).encode('utf-8')).hexdigest()[:8]
+
+
+def layout_cache_tag() -> str:
+    if _cache_tags['layout'] is None:
+        code = (build_tree_layout, family_stats, layout_to_json, layout_from_json, PlacedPerson, ConnectorList)
+        _cache_tags['layout'] = _source_hash(repr(TREE_LAYOUT_KEY), *(inspect.getsource(obj) for obj in code))
+    return _cache_tags['layout']
+
+
+def canvas_cache_tag() -> str:
+    if _cache_tags['canvas'] is None:
+        source = app.jinja_loader.get_source(app.jinja_env, '_tree_canvas.html')[0]
+        _cache_tags['canvas'] = f'{layout_cache_tag()}:{_source_hash(source)}'
+    return _cache_tags['canvas']
+
+
+def render_tree_canvas(tree: dict, path: Path) -> Markup:
+    version = family_version(path)
+    if version is None or tree.get('thumbs_pending'):
+        return Markup(render_template('_tree_canvas.html', tree=tree))
+    key = (str(path), version, TREE_LAYOUT_KEY)
+    html = CANVAS_CACHE.get(key)
+    if html is None:
+        shared_version = f'{version}:{canvas_cache_tag()}'
+        html = SHARED_CACHE.get(f'canvas:{path}', shared_version)
+        if html is None:
+            html = render_template('_tree_canvas.html', tree=tree)
+            SHARED_CACHE.put(f'canvas:{path}', shared_version, html)
+        CANVAS_CACHE.put(key, html)
+    return Markup(html)
+
+
+def build_public_snapshot(username: str) -> tuple[Path, dict | None]:
+    target = public_snapshot_dir(username)
+    family = load_json(user_family_path(username), default={})
+    if not family.get('meta', {}).get('is_public'):
+        return target, None
+
+    # Rendered without a session so the snapshot never carries the owner's nav chip.
+    with app.test_request_context('/'):
+        json_url = url_for('static', filename=f'public/{target.name}/family.json')
+        tree_data = build_tree_layout(family, generate_thumbs=True)
+        tree_canvas = Markup(render_template('_tree_canvas.html', tree=tree_data))
+        files = {
+            'family.json': json.dumps(public_family_payload(family), separators=(',', ':')),
+            'tree.html': render_template('tree.html', tree_data=tree_data, tree_canvas=tree_canvas),
+            'timeline.html': render_template('timeline.html', public_slug=target.name, snapshot_api_url=json_url),
+            'map.html': render_template('map.html', public_slug=target.name, snapshot_api_url=json_url),
+        }
+    return target, files
+
+
+PUBLISHER = Publisher(build_public_snapshot)
+
+
+@task('layout')
+def layout_job(ctx) -> dict:
+    ctx.progress(0.1, 'Loading family')
+    family, path = user_family_source(ctx.family_key)
+    ctx.progress(0.3, 'Computing layout')
+    # Goes through the shared cache, so web workers pick up the result.
+    tree = tree_layout(path, family)
+    return {'stats': tree['stats'], 'canvas_width': tree['canvas_width'], 'canvas_height': tree['canvas_height']}
+
+
+@task('thumbnails')
+def thumbnails_job(ctx) -> dict:
+    people = ensure_user_family(ctx.family_key).get('people', [])
+    for done, person in enumerate(people, 1):
+        THUMBNAILS.thumbnails_for(person.get('photo', ''))
+        if done % 10 == 0 or done == len(people):
+            ctx.progress(done / len(people), f'{done}/{len(people)} portraits')
+    return {'portraits': len(people)}
+
+
+@task('export')
+def export_job(ctx) -> dict:
+    ctx.progress(0.1, 'Loading family')
+    family = ensure_user_family(ctx.family_key)
+    ensure_dir(EXPORTS_DIR)
+    name = f'{slugify(ctx.family_key)}-{ctx.id}.json.gz'
+    ctx.progress(0.5, 'Writing export')
+    with gzip.open(EXPORTS_DIR / name, 'wt', encoding='utf-8') as f:
+        json.dump(family, f, indent=2)
+    return {'file': name, 'people': len(family.get('people', []))}
+
+
+def job_status(job: dict) -> dict:
+    status = {key: job[key] for key in (
+        'id', 'kind', 'status', 'progress', 'message', 'result', 'error', 'created_at', 'started_at', 'finished_at',
+    )}
+    status['status_url'] = url_for('job_detail', job_id=job['id'])
+    if job['kind'] == 'export' and job['status'] == 'done':
+        status['download_url'] = url_for('job_download', job_id=job['id'])
+    return status
+
+
+def owned_job(job_id: int) -> dict:
+    user = current_user()
+    job = JOBS.get(job_id)
+    if not user or not job or job['owner'] != user['username']:
+        abort(404)
+    return job
+
+
+@app.after_request
+def cache_thumbnails_forever(response):
+    # Thumbnail filenames carry a content hash, so a given URL never changes.
+    if request.path.startswith('/static/thumbs/') and response.status_code == 200:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    return response
+
+
 @app.context_processor
 def inject_helpers():
     return {'logged_in_user': current_user()}
@@ -307,8 +634,9 @@ def index():
     marketing = load_marketing_data()
     user_tree = None
     if user:
-        user_family = ensure_user_family(user['username'])
-        user_tree = build_tree_layout(user_family)
+        user_family, path = user_family_source(user['username'])
+        g.family_size = len(user_family.get('people', []))
+        user_tree = tree_layout(path, user_family)
     return render_template('index.html', data=marketing, user_family=user_tree, user=user)
 
 
@@ -318,11 +646,15 @@ def login():
         username = request.form.get('username', '').strip().lower()
         password = request.form.get('password', '').strip()
         user = get_user(username)
-        if not user or user.get('password') != password:
+        try:
+            valid = bool(user) and verify_login(user, password)
+        except AuthBusy:
+            flash('Sign-in is busy right now. Please try again in a moment.')
+            return redirect(url_for('login'))
+        if not valid:
             flash('Invalid username or password.')
             return redirect(url_for('login'))
         session['username'] = username
-        ensure_user_family(username)
         return redirect(url_for('dashboard'))
     return render_template('login.html')
 
@@ -330,7 +662,10 @@ def login():
 @app.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('index'))
+    response = redirect(url_for('index'))
+    # Drops familySync.js's localStorage copy of the family, so it cannot be read after sign-out.
+    response.headers['Clear-Site-Data'] = '"storage"'
+    return response
 
 
 @app.route('/dashboard')
@@ -338,22 +673,52 @@ def dashboard():
     user = current_user()
     if not user:
         return redirect(url_for('login'))
-    family = ensure_user_family(user['username'])
-    tree = build_tree_layout(family)
-    return render_template('dashboard.html', user=user, family=family, tree=tree)
+    family, path = user_family_source(user['username'])
+    g.family_size = len(family.get('people', []))
+    tree = tree_layout(path, family)
+    tree_canvas = render_tree_canvas(tree, path)
+    return render_template('dashboard.html', user=user, family=family, tree=tree, tree_canvas=tree_canvas)
 
 
 @app.route('/tree')
 def tree():
     owner = request.args.get('user')
+    if not owner and current_user():
+        owner = current_user()['username']
     if owner:
-        family = ensure_user_family(owner)
-    elif current_user():
-        family = ensure_user_family(current_user()['username'])
+        family, path = user_family_source(owner)
     else:
-        family = load_json(DEMO_FAMILY_PATH, default={})
-    tree_data = build_tree_layout(family)
-    return render_template('tree.html', tree_data=tree_data)
+        path = DEMO_FAMILY_PATH
+        family = load_family(path)
+    g.family_size = len(family.get('people', []))
+    tree_data = tree_layout(path, family)
+    tree_canvas = render_tree_canvas(tree_data, path)
+    return render_template('tree.html', tree_data=tree_data, tree_canvas=tree_canvas)
+
+
+@app.get('/timeline')
+def timeline_view():
+    # Signed in, timeline.js reads /api/tree/me through familySync.js's versioned client cache.
+    return render_template('timeline.html', current_user=current_user())
+
+
+@app.get('/map')
+def map_view():
+    return render_template('map.html', current_user=current_user())
+
+
+@app.get('/p/<slug>')
+def public_family(slug: str):
+    page = request.args.get('view', 'tree')
+    if page not in ('tree', 'timeline', 'map'):
+        page = 'tree'
+    snapshot = PUBLIC_DIR / slug / f'{page}.html'
+    if not re.fullmatch(r'[a-z0-9_]+-[0-9a-f]{8}', slug) or not snapshot.exists():
+        # Links saved before slugs carried a hash use the username.
+        snapshot = public_snapshot_dir(slug) / f'{page}.html'
+    if not snapshot.exists():
+        return redirect(url_for('index'))
+    return redirect(url_for('static', filename=f'public/{snapshot.parent.name}/{page}.html'))
 
 
 @app.post('/profile/update')
@@ -367,7 +732,10 @@ def update_profile():
     profile_photo = request.form.get('profile_photo', '').strip()
     if profile_photo:
         family['meta']['profile_photo'] = profile_photo
-    save_user_family(user['username'], family)
+    family['meta']['is_public'] = request.form.get('is_public') == 'on'
+    if family['meta']['is_public']:
+        family['meta']['public_slug'] = public_slug(user['username'])
+    save_user_family(user['username'], family, 'Updated profile')
     flash('Profile updated.')
     return redirect(url_for('dashboard'))
 
@@ -401,7 +769,7 @@ def add_person():
         'died': request.form.get('died', '').strip(),
         'photo': request.form.get('photo', '').strip() or '/static/img/you.jpg',
     })
-    save_user_family(user['username'], family)
+    save_user_family(user['username'], family, f'Added {name}')
     flash(f'{name} added.')
     return redirect(url_for('dashboard'))
 
@@ -422,18 +790,198 @@ def add_relationship():
         return redirect(url_for('dashboard'))
 
     if rel_type == 'spouse':
-        relationships.append({'type': 'spouse', 'a': first, 'b': second})
-        flash('Spouse connection added.')
+        relationship, message = {'type': 'spouse', 'a': first, 'b': second}, 'Spouse connection added.'
     elif rel_type == 'parent-child':
-        relationships.append({'parent': first, 'child': second})
-        flash('Parent-child connection added.')
+        relationship, message = {'parent': first, 'child': second}, 'Parent-child connection added.'
     else:
         flash('Unsupported relationship type.')
         return redirect(url_for('dashboard'))
+    wanted = history_identity('relationships', relationship)
+    if any(history_identity('relationships', existing) == wanted for existing in relationships):
+        flash('That connection already exists.')
+        return redirect(url_for('dashboard'))
+    relationships.append(relationship)
+    flash(message)
 
-    save_user_family(user['username'], family)
+    save_user_family(user['username'], family, f'Added {rel_type} {first} / {second}')
     return redirect(url_for('dashboard'))
 
 
+@app.get('/api/tree/me')
+def api_tree_me():
+    user = current_user()
+    if not user:
+        return jsonify({'error': 'login required'}), 401
+    family, version = user_family_with_version(user['username'])
+    return family_json_response(user['username'], version, family)
+
+
+@app.get('/api/tree/me/changes')
+def api_tree_me_changes():
+    user = current_user()
+    if not user:
+        return jsonify({'error': 'login required'}), 401
+    family, version = user_family_with_version(user['username'])
+    return family_changes_response(HISTORY, user['username'], version, lambda: family)
+
+
+def owned_family(family_id: str) -> str:
+    user = current_user()
+    if not user or user['username'] != family_id:
+        abort(404)
+    return family_id
+
+
+@app.get('/api/tree/<family_id>/versions')
+def tree_versions(family_id: str):
+    key = owned_family(family_id)
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    return jsonify({'family': key, 'current': HISTORY.latest(key), 'versions': HISTORY.versions(key, limit)})
+
+
+@app.get('/api/tree/<family_id>/versions/<int:version>')
+def tree_version(family_id: str, version: int):
+    key = owned_family(family_id)
+    try:
+        family = HISTORY.load(key, version)
+        with timed('serialize'):
+            return jsonify(family)
+    except VersionNotFound:
+        abort(404)
+
+
+@app.get('/api/tree/<family_id>/diff')
+def tree_diff(family_id: str):
+    key = owned_family(family_id)
+    old = request.args.get('from', type=int)
+    new = request.args.get('to', HISTORY.latest(key), type=int)
+    if old is None or new is None:
+        return jsonify({'error': 'from (and a recorded version to diff against) is required'}), 400
+    try:
+        return jsonify(HISTORY.diff(key, old, new))
+    except VersionNotFound as exc:
+        return jsonify({'error': str(exc)}), 404
+
+
+@app.post('/api/tree/<family_id>/versions/<int:version>/restore')
+def restore_tree_version(family_id: str, version: int):
+    key = owned_family(family_id)
+    try:
+        family = HISTORY.load(key, version)
+    except VersionNotFound:
+        abort(404)
+    save_user_family(key, family, f'Restored version {version}')
+    return jsonify({'restored': version, 'version': HISTORY.latest(key)})
+
+
+@app.post('/api/jobs')
+def create_job():
+    user = current_user()
+    if not user:
+        return jsonify({'error': 'login required'}), 401
+    kind = (request.get_json(silent=True) or request.form).get('kind', '').strip()
+    if kind not in JOB_KINDS:
+        return jsonify({'error': f'kind must be one of {", ".join(JOB_KINDS)}'}), 400
+    job_id = JOBS.enqueue(kind, user['username'], owner=user['username'])
+    return jsonify(job_status(JOBS.get(job_id))), 202, {'Location': url_for('job_detail', job_id=job_id)}
+
+
+@app.get('/api/jobs')
+def list_jobs():
+    user = current_user()
+    if not user:
+        return jsonify({'error': 'login required'}), 401
+    return jsonify({'jobs': [job_status(job) for job in JOBS.list_for_owner(user['username'])]})
+
+
+@app.get('/api/jobs/<int:job_id>')
+def job_detail(job_id: int):
+    return jsonify(job_status(owned_job(job_id)))
+
+
+@app.get('/api/jobs/<int:job_id>/download')
+def job_download(job_id: int):
+    job = owned_job(job_id)
+    if job['kind'] != 'export' or job['status'] != 'done':
+        abort(404)
+    return send_file(EXPORTS_DIR / job['result']['file'], as_attachment=True)
+
+
+STORAGE_SCHEMA = '2'
+_init_lock = threading.Lock()
+_storage_ready = False
+
+
+def _family_key(name: str) -> str | None:
+    return name[:-len('.json')] if name.endswith('.json') else None
+
+
+def init_storage() -> float:
+    # Run up front by `flask --app app init` or gunicorn on_starting; otherwise by the first request.
+    global _storage_ready
+    with _init_lock:
+        started = time.perf_counter()
+        ensure_dir(USER_FAMILIES_DIR)
+        migrate_to_shards(USER_FAMILIES_DIR, _family_key)
+        JOBS.connect().close()
+        write_init_marker(DATA_DIR, 'app', STORAGE_SCHEMA)
+        _storage_ready = True
+        elapsed = time.perf_counter() - started
+    REGISTRY.set_gauge('lineagemap_startup_seconds', elapsed, {'phase': 'init'})
+    return elapsed
+
+
+@app.before_request
+def ensure_storage():
+    global _storage_ready
+    if _storage_ready:
+        return
+    if init_marker_matches(DATA_DIR, 'app', STORAGE_SCHEMA):
+        _storage_ready = True
+    else:
+        init_storage()
+
+
+@app.cli.command('init')
+def init_command() -> None:
+    """Create data directories, shard family files and create the job queue database."""
+    elapsed = init_storage()
+    click.echo(f'Storage initialized in {elapsed * 1000:.1f} ms ({DATA_DIR})')
+
+
+@app.cli.command('migrate-storage')
+def migrate_storage_command() -> None:
+    """Move flat user_families/<username>.json files into hashed fan-out subdirectories."""
+    ensure_dir(USER_FAMILIES_DIR)
+    moved = migrate_to_shards(USER_FAMILIES_DIR, _family_key)
+    click.echo(f'Moved {moved} family files into {USER_FAMILIES_DIR}')
+
+
+@app.cli.command('republish')
+def republish_command() -> None:
+    """Rebuild every public snapshot and remove snapshots no public family owns."""
+    init_storage()
+    keep = set()
+    for user in get_users().get('users', []):
+        target = public_snapshot_dir(user['username'])
+        PUBLISHER.publish_now(user['username'])
+        if target.exists():
+            keep.add(target.name)
+    removed = 0
+    for entry in PUBLIC_DIR.iterdir() if PUBLIC_DIR.exists() else ():
+        if entry.is_dir() and not entry.name.startswith('.') and entry.name not in keep:
+            remove_snapshot(entry)
+            removed += 1
+    click.echo(f'Published {len(keep)} snapshots, removed {removed} stale ones ({PUBLIC_DIR})')
+
+
+@app.cli.command('jobs-worker')
+@click.option('--processes', default=2, show_default=True, help='Worker processes to run.')
+@click.option('--poll', default=0.5, show_default=True, help='Seconds between queue polls when idle.')
+def jobs_worker(processes: int, poll: float) -> None:
+    """Run background job workers (layout, thumbnails, export)."""
+    run_workers(JOBS, processes=processes, poll_interval=poll)
+
+
 if __name__ == '__main__':
     app.run(debug=True)
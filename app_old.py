@@ -19,14 +19,18 @@ import json
 import os
 import shutil
 import sqlite3
-import uuid
-from datetime import datetime
+import threading
+import time
 from functools import wraps
 from pathlib import Path
 from typing import Any, Dict, Optional
 
 from flask import Flask, abort, jsonify, redirect, render_template, request, session, url_for
-from werkzeug.security import check_password_hash, generate_password_hash
+
+from auth import AuthBusy, passwords
+from history import FamilyHistory, family_changes_response, family_json_response
+from metrics import REGISTRY, instrument, timed
+from storage import ensure_dir, init_marker_matches, mark_dirs_ready, migrate_to_shards, shard_dir, write_init_marker
 
 # -----------------------------
 # PATHS / STORAGE (Render)
@@ -38,7 +42,9 @@ DATA_DIR_ENV = os.environ.get("DATA_DIR", "data")
 DATA_DIR = Path(DATA_DIR_ENV)
 if not DATA_DIR.is_absolute():
     DATA_DIR = APP_DIR / DATA_DIR
-DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+# Bump when init_storage() gains new one-time work, so existing disks re-run it once.
+STORAGE_SCHEMA = "2"
 
 # Session secret (set LINEAGEMAP_SECRET in production)
 SECRET = os.environ.get("LINEAGEMAP_SECRET", "dev-secret-change-me")
@@ -55,6 +61,7 @@ app = Flask(
     static_folder=str(APP_DIR / "static"),
 )
 app.secret_key = SECRET
+instrument(app)
 
 
 # -----------------------------
@@ -134,26 +141,22 @@ def db_init() -> None:
             con.execute("ALTER TABLE users ADD COLUMN is_public INTEGER NOT NULL DEFAULT 0")
         if "state_json" not in cols:
             con.execute("ALTER TABLE users ADD COLUMN state_json TEXT NOT NULL DEFAULT '{}'")
+        # family_file is no longer stored (paths are computed by user_family_file); clear pre-shard paths.
+        con.execute("UPDATE users SET family_file = '' WHERE family_file != ''")
 
         con.commit()
 
 
-db_init()
-
-
 # -----------------------------
 # FILES (Families)
 # -----------------------------
 def families_dir() -> Path:
-    d = DATA_DIR / "families"
-    d.mkdir(parents=True, exist_ok=True)
-    return d
+    return DATA_DIR / "families"
 
 
 def user_family_file(uid: int) -> Path:
-    d = families_dir() / str(uid)
-    d.mkdir(parents=True, exist_ok=True)
-    return d / "family.json"
+    # Pure path computation (hashed fan-out, see storage.py); writers create the parent directory.
+    return shard_dir(families_dir(), str(uid)) / str(uid) / "family.json"
 
 
 def _safe_family_name(name: str) -> str:
@@ -222,6 +225,7 @@ def _normalize_relationships(rels: Any) -> list[dict]:
     return out
 
 
+@timed("json_load")
 def load_family_file(path: Path) -> Dict[str, Any]:
     if not path.exists():
         return {"people": [], "relationships": []}
@@ -242,21 +246,19 @@ def load_family_file(path: Path) -> Dict[str, Any]:
     return data
 
 
-def load_user_family(uid: int) -> Dict[str, Any]:
+def load_user_family(uid: int, base: Optional[str] = None) -> Dict[str, Any]:
     path = user_family_file(uid)
     if path.exists():
         return load_family_file(path)
-    # If user family missing, fall back to default sample
-    return load_sample_tree(DEFAULT_SAMPLE_ID)
+    # Copy-on-write: accounts read their shared base until they save a family of their own.
+    return family_base_payload(base)
 
 
 # -----------------------------
 # SAMPLES (built-in demo datasets)
 # -----------------------------
 def samples_disk_dir() -> Path:
-    d = DATA_DIR / "samples"
-    d.mkdir(parents=True, exist_ok=True)
-    return d
+    return DATA_DIR / "samples"
 
 
 def samples_repo_dir() -> Path:
@@ -274,11 +276,10 @@ def seed_samples_if_missing() -> None:
     if not repo.exists():
         return
 
-    target = samples_disk_dir()
+    target = ensure_dir(samples_disk_dir())
     for src in repo.glob("*.json"):
         dst = target / src.name
         if not dst.exists():
-            dst.parent.mkdir(parents=True, exist_ok=True)
             shutil.copy2(src, dst)
 
 
@@ -293,6 +294,7 @@ def _sample_paths(sample_id: str) -> list[Path]:
     ]
 
 
+@timed("json_load")
 def _load_sample_json(sample_id: str) -> dict:
     for p in _sample_paths(sample_id):
         if p.exists():
@@ -329,13 +331,78 @@ def load_sample_tree(sample_id: str) -> Dict[str, Any]:
     return tree
 
 
-# Seed samples once on import (safe + fast)
-seed_samples_if_missing()
+# -----------------------------
+# STARTUP (one-time storage init)
+# -----------------------------
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def migrate_family_layout() -> int:
+    """Move legacy families/<uid>/ directories into the hashed layout; returns how many moved."""
+    # Two-digit shard directories ("35/6a/...") are digits too; migrate_to_shards() never stages
+    # a directory that already holds <hex>/ subdirectories, so a lost .layout cannot nest them.
+    return migrate_to_shards(families_dir(), lambda name: name if name.isdigit() else None)
+
+
+def init_storage(force: bool = False) -> float:
+    """
+    One-time setup: data dirs, sharded family layout, users DB schema + migrations, sample seeding.
+    Run it from `flask --app app_old init` or the gunicorn on_starting hook; workers
+    that start without it fall back to ensure_initialized() on their first request.
+    Returns the seconds spent (0.0 if already done).
+    """
+    global _initialized
+    with _init_lock:
+        if _initialized and not force:
+            return 0.0
+        started = time.perf_counter()
+        ensure_dir(DATA_DIR)
+        ensure_dir(families_dir())
+        migrate_family_layout()
+        db_init()
+        seed_samples_if_missing()
+        write_init_marker(DATA_DIR, "app_old", STORAGE_SCHEMA)
+        _initialized = True
+        elapsed = time.perf_counter() - started
+    REGISTRY.set_gauge("lineagemap_startup_seconds", elapsed, {"phase": "init"})
+    return elapsed
+
+
+def ensure_initialized() -> None:
+    global _initialized
+    if _initialized:
+        return
+    if init_marker_matches(DATA_DIR, "app_old", STORAGE_SCHEMA):
+        mark_dirs_ready(DATA_DIR, families_dir(), samples_disk_dir())
+        _initialized = True
+    else:
+        init_storage()
+
+
+@app.before_request
+def _lazy_init() -> None:
+    ensure_initialized()
+
+
+@app.cli.command("init")
+def init_command() -> None:
+    """Create data dirs, migrate the users DB and family layout, and seed samples."""
+    elapsed = init_storage(force=True)
+    print(f"Storage initialized in {elapsed * 1000:.1f} ms ({DATA_DIR})")
+
+
+@app.cli.command("migrate-storage")
+def migrate_storage_command() -> None:
+    """Move flat families/<uid>/ directories into hashed fan-out subdirectories."""
+    ensure_dir(families_dir())
+    print(f"Moved {migrate_family_layout()} family directories into {families_dir()}")
 
 
 # -----------------------------
 # CURRENT USER
 # -----------------------------
+@timed("user_lookup")
 def get_current_user() -> Optional[dict]:
     uid = get_session_uid()
     if uid is None:
@@ -343,7 +410,7 @@ def get_current_user() -> Optional[dict]:
 
     with db_connect() as con:
         row = con.execute(
-            "SELECT id, email, family_file, public_slug, is_public, state_json FROM users WHERE id = ?",
+            "SELECT id, email, public_slug, is_public, state_json FROM users WHERE id = ?",
             (uid,),
         ).fetchone()
 
@@ -359,7 +426,7 @@ def get_current_user() -> Optional[dict]:
     return {
         "id": int(row["id"]),
         "email": row["email"],
-        "family_file": row["family_file"],
+        "family_file": str(user_family_file(int(row["id"]))),
         "public_slug": row["public_slug"],
         "is_public": bool(row["is_public"]),
         "state": state,
@@ -385,23 +452,32 @@ def inject_sample_id() -> dict:
 # -----------------------------
 # STARTER DATASET FOR NEW USERS
 # -----------------------------
+# New accounts reference this immutable base (state_json {"base": "starter"}) instead of
+# getting their own file at sign-up; ids are fixed so every account sees the same data.
+STARTER_BASE = "starter"
+
+
 def starter_family_payload() -> Dict[str, Any]:
-    p1 = f"p_{uuid.uuid4().hex[:6]}"
-    p2 = f"p_{uuid.uuid4().hex[:6]}"
     return {
         "meta": {
             "family_name": "My Family",
-            "created_at": datetime.utcnow().isoformat() + "Z",
             "starter": True,
         },
         "people": [
-            {"id": p1, "name": "", "born": "", "died": "", "photo": "", "location": {"city": "", "region": "", "country": ""}, "events": []},
-            {"id": p2, "name": "", "born": "", "died": "", "photo": "", "location": {"city": "", "region": "", "country": ""}, "events": []},
+            {"id": "p_starter1", "name": "", "born": "", "died": "", "photo": "", "location": {"city": "", "region": "", "country": ""}, "events": []},
+            {"id": "p_starter2", "name": "", "born": "", "died": "", "photo": "", "location": {"city": "", "region": "", "country": ""}, "events": []},
         ],
         "relationships": [],
     }
 
 
+def family_base_payload(base: Optional[str]) -> Dict[str, Any]:
+    if base == STARTER_BASE:
+        return starter_family_payload()
+    # Accounts created before copy-on-write with no family file: default sample, as before.
+    return load_sample_tree(DEFAULT_SAMPLE_ID)
+
+
 # -----------------------------
 # AUTH HELPERS
 # -----------------------------
@@ -418,9 +494,18 @@ def authenticate_user(email: str, password: str) -> Optional[dict]:
 
     if not row:
         return None
-    if not check_password_hash(row["password_hash"], password):
+
+    # Runs on the bounded hashing pool; may raise AuthBusy under a login storm.
+    ok, upgraded = passwords.verify_and_upgrade(row["password_hash"], password)
+    if not ok:
         return None
 
+    if upgraded:
+        # Transparent upgrade of hashes made with older KDF parameters.
+        with db_connect() as con:
+            con.execute("UPDATE users SET password_hash = ? WHERE id = ?", (upgraded, row["id"]))
+            con.commit()
+
     return {"id": int(row["id"]), "email": row["email"]}
 
 
@@ -433,8 +518,8 @@ def create_user(email: str, password: str) -> int:
     if len(password) < 8:
         raise ValueError("Password must be at least 8 characters.")
 
-    pw_hash = generate_password_hash(password)
-    default_state = {"family_id": "me"}
+    pw_hash = passwords.hash(password)
+    default_state = {"family_id": "me", "base": STARTER_BASE}
 
     try:
         with db_connect() as con:
@@ -443,13 +528,7 @@ def create_user(email: str, password: str) -> int:
                 (email, pw_hash, "", json.dumps(default_state)),
             )
             uid = require_lastrowid(cur)
-
-            dst = user_family_file(uid)
-            if not dst.exists():
-                dst.parent.mkdir(parents=True, exist_ok=True)
-                dst.write_text(json.dumps(starter_family_payload(), indent=2), encoding="utf-8")
-
-            con.execute("UPDATE users SET family_file = ? WHERE id = ?", (str(dst), uid))
+            # No file yet: the account reads the starter base until its first save creates user_family_file(uid).
             con.commit()
 
         return uid
@@ -511,7 +590,10 @@ def login_post():
     email = request.form.get("email", "").strip().lower()
     password = request.form.get("password", "")
 
-    user = authenticate_user(email, password)
+    try:
+        user = authenticate_user(email, password)
+    except AuthBusy:
+        return render_template("login.html", error="Sign-in is busy right now. Please try again in a moment."), 503
     if not user:
         return render_template("login.html", error="Invalid email or password.")
 
@@ -534,6 +616,8 @@ def register_post():
         uid = create_user(email, password)
     except ValueError as e:
         return render_template("register.html", error=str(e))
+    except AuthBusy:
+        return render_template("register.html", error="Sign-up is busy right now. Please try again in a moment."), 503
 
     session["user_id"] = uid
     return redirect(url_for("tree_view"))
@@ -543,7 +627,39 @@ def register_post():
 def logout():
     session.pop("user_id", None)
     next_url = request.args.get("next")
-    return redirect(next_url or url_for("index"))
+    response = redirect(next_url or url_for("index"))
+    # Drops familySync.js's localStorage copy of the family, so it cannot be read after sign-out.
+    response.headers["Clear-Site-Data"] = '"storage"'
+    return response
+
+
+# -----------------------------
+# FAMILY SYNC (delta sync for /api/tree/me, see static/js/familySync.js)
+# -----------------------------
+# This app never writes family files itself, so a version is recorded whenever the family
+# /api/tree/me serves changes on disk (file mtime/size, or the shared base it falls back to).
+# Keys are "uid-<id>" so they never clash with app.py's username keys in a shared DATA_DIR.
+HISTORY = FamilyHistory(DATA_DIR / "history.db")
+
+
+def user_family_with_version(uid: int) -> tuple[Dict[str, Any], int]:
+    path = user_family_file(uid)
+    try:
+        st = path.stat()
+        source: tuple = ("file", st.st_mtime_ns, st.st_size)
+        data = load_family_file(path)
+    except FileNotFoundError:
+        user = get_current_user()
+        base = user["state"].get("base") if user else None
+        source = ("base", base)
+        if base != STARTER_BASE:
+            # The default sample can be replaced by a deploy; its file stamp is part of the source.
+            sample = next((p for p in _sample_paths(DEFAULT_SAMPLE_ID) if p.exists()), None)
+            if sample is not None:
+                st = sample.stat()
+                source += (str(sample), st.st_mtime_ns, st.st_size)
+        data = family_base_payload(base)
+    return data, HISTORY.current(f"uid-{uid}", source, data)
 
 
 # -----------------------------
@@ -554,7 +670,9 @@ def api_tree(name: str):
     path = family_path(name)
     if not path.exists():
         return jsonify({"error": "not found", "expected_file": str(path)}), 404
-    return jsonify(load_family_file(path))
+    data = load_family_file(path)
+    with timed("serialize"):
+        return jsonify(data)
 
 
 @app.get("/api/tree/me")
@@ -562,11 +680,21 @@ def api_tree_me():
     uid = get_session_uid()
 
     if uid is not None:
-        path = user_family_file(uid)
-        if path.exists():
-            return jsonify(load_family_file(path))
+        data, version = user_family_with_version(uid)
+        return family_json_response(f"uid-{uid}", version, data)
+
+    data = load_sample_tree(DEFAULT_SAMPLE_ID)
+    with timed("serialize"):
+        return jsonify(data)
+
 
-    return jsonify(load_sample_tree(DEFAULT_SAMPLE_ID))
+@app.get("/api/tree/me/changes")
+def api_tree_me_changes():
+    uid = get_session_uid()
+    if uid is None:
+        return jsonify({"error": "login required"}), 401
+    data, version = user_family_with_version(uid)
+    return family_changes_response(HISTORY, f"uid-{uid}", version, lambda: data)
 
 
 @app.get("/api/sample/<sample_id>/tree")
@@ -574,7 +702,9 @@ def api_sample_tree(sample_id: str):
     sample_id = (sample_id or "").strip().lower()
     if sample_id not in ALLOWED_SAMPLES:
         abort(404, description="Sample not found.")
-    return jsonify(load_sample_tree(sample_id))
+    data = load_sample_tree(sample_id)
+    with timed("serialize"):
+        return jsonify(data)
 
 
 # -----------------------------
@@ -0,0 +1,98 @@
+"""
+Password hashing service shared by app.py and app_old.py.
+
+KDF work runs on a small bounded thread pool (hashlib's scrypt/pbkdf2 release the GIL),
+so a burst of logins can only occupy AUTH_WORKERS cores; once AUTH_MAX_PENDING calls
+are queued, further attempts fail fast with AuthBusy instead of piling up on request threads.
+"""
+
+from __future__ import annotations
+
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from functools import cached_property
+from typing import Optional
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASH_METHOD = os.environ.get('LINEAGEMAP_HASH_METHOD', 'scrypt:32768:8:1')
+SALT_LENGTH = int(os.environ.get('LINEAGEMAP_HASH_SALT_LENGTH', '16'))
+AUTH_WORKERS = int(os.environ.get('LINEAGEMAP_AUTH_WORKERS', '2'))
+AUTH_MAX_PENDING = int(os.environ.get('LINEAGEMAP_AUTH_MAX_PENDING', '32'))
+AUTH_TIMEOUT = float(os.environ.get('LINEAGEMAP_AUTH_TIMEOUT', '10'))
+
+
+class AuthBusy(RuntimeError):
+    """Raised when the hashing pool is saturated; callers should answer 503 / retry later."""
+
+
+class PasswordService:
+    def __init__(
+        self,
+        method: str = HASH_METHOD,
+        salt_length: int = SALT_LENGTH,
+        workers: int = AUTH_WORKERS,
+        max_pending: int = AUTH_MAX_PENDING,
+        timeout: float = AUTH_TIMEOUT,
+    ):
+        self.method = method
+        self.salt_length = salt_length
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='auth-kdf')
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise AuthBusy('Too many sign-in attempts in progress.')
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise AuthBusy('Password check timed out.')
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, stored_hash: str, password: str) -> bool:
+        if not stored_hash:
+            return False
+        return bool(self._run(check_password_hash, stored_hash, password))
+
+    @cached_property
+    def stored_method(self) -> str:
+        """The method prefix werkzeug writes for ``self.method`` (``scrypt`` is stored as ``scrypt:32768:8:1``)."""
+        return generate_password_hash('probe', self.method, 1).partition('$')[0]
+
+    def needs_rehash(self, stored_hash: str) -> bool:
+        """True when the stored hash was made with different KDF parameters than the current config."""
+        method, _, rest = (stored_hash or '').partition('$')
+        salt, _, _ = rest.partition('$')
+        return method != self.stored_method or len(salt) != self.salt_length
+
+    def verify_and_upgrade(self, stored_hash: str, password: str) -> tuple[bool, Optional[str]]:
+        """
+        Verify a password; on success also return a fresh hash if the stored one is outdated.
+        Returns (ok, new_hash_or_None).
+        """
+        if not self.verify(stored_hash, password):
+            return False, None
+        if self.needs_rehash(stored_hash):
+            return True, self.hash(password)
+        return True, None
+
+    def verify_legacy_plaintext(self, stored_password: str, password: str) -> tuple[bool, Optional[str]]:
+        """Constant-time check for accounts still holding a plaintext password; returns a hash to store on success."""
+        if not stored_password or not hmac.compare_digest(stored_password.encode(), password.encode()):
+            return False, None
+        return True, self.hash(password)
+
+
+passwords = PasswordService()
@@ -0,0 +1,283 @@
+"""
+Benchmark suite for layout, stats, normalization, file loading and page/API endpoints.
+
+    python -m benchmarks.run                       # default sizes, writes benchmarks/results/<stamp>.json
+    python -m benchmarks.run --sizes 50,500 --repeat 20
+    python -m benchmarks.run compare OLD.json NEW.json [--threshold 0.10]
+
+Everything runs against a throwaway DATA_DIR; the repo's data/ is never touched.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from benchmarks.synthetic import FamilyShape, generate_family
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+DEFAULT_SIZES = (40, 400, 2000)
+SAMPLE_IDS = ('stark', 'kennedy')
+
+
+def measure(fn: Callable[[], object], repeat: int, warmup: int = 2) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        fn()
+        samples.append((time.perf_counter_ns() - start) / 1e6)
+    samples.sort()
+    return {
+        'unit': 'ms',
+        'runs': repeat,
+        'min': round(samples[0], 4),
+        'median': round(statistics.median(samples), 4),
+        'mean': round(statistics.fmean(samples), 4),
+        'p95': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        'stdev': round(statistics.stdev(samples), 4) if len(samples) > 1 else 0.0,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def load_apps(data_dir: Path):
+    """Import both apps with storage redirected into data_dir."""
+    os.environ['DATA_DIR'] = str(data_dir)
+    sys.path.insert(0, str(REPO_DIR))
+    import app as new_app
+    import app_old as old_app
+
+    new_app.DATA_DIR = data_dir
+    new_app.USER_FAMILIES_DIR = data_dir / 'user_families'
+    new_app.USERS_PATH = data_dir / 'users.json'
+    new_app.JOBS.db_path = data_dir / 'jobs.db'
+    new_app.SHARED_CACHE.db_path = data_dir / 'cache.db'
+    new_app.HISTORY.db_path = data_dir / 'history.db'
+    new_app.THUMBNAILS.out_dir = data_dir / 'thumbs'
+    new_app.init_storage()
+    old_app.init_storage()
+    return new_app, old_app
+
+
+def bench_functions(new_app, old_app, family: dict, data_dir: Path, label: str, repeat: int) -> dict:
+    results = {}
+    results[f'build_tree_layout[{label}]'] = measure(lambda: new_app.build_tree_layout(family), repeat)
+    results[f'family_stats[{label}]'] = measure(lambda: new_app.family_stats(family), repeat)
+    rels = family['relationships']
+    results[f'_normalize_relationships[{label}]'] = measure(lambda: old_app._normalize_relationships(rels), repeat)
+
+    path = data_dir / f'family_{label}.json'
+    path.write_text(json.dumps(family, indent=2), encoding='utf-8')
+    results[f'load_family_file[{label}]'] = measure(lambda: old_app.load_family_file(path), repeat)
+    return results
+
+
+def bench_endpoints(new_app, old_app, family: dict, label: str, repeat: int) -> dict:
+    results = {}
+
+    username = f'bench_{label}'.replace('.', '_')
+    users = new_app.load_json(new_app.USERS_PATH, default={'users': []})
+    users['users'].append({'username': username, 'name': 'Bench', 'password': 'unused'})
+    new_app.save_json(new_app.USERS_PATH, users)
+    new_app.save_user_family(username, family)
+
+    client = new_app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['username'] = username
+
+    def get(c, url):
+        def call():
+            response = c.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f'{url} -> {response.status_code}')
+        return call
+
+    for url in ('/tree', '/dashboard'):
+        results[f'GET {url} warm[{label}]'] = measure(get(client, url), repeat)
+
+        def shared(url=url):
+            # Another worker already computed it: only the shared SQLite tier is warm.
+            new_app.CANVAS_CACHE.clear()
+            new_app.LAYOUT_CACHE.clear()
+            get(client, url)()
+        results[f'GET {url} shared[{label}]'] = measure(shared, repeat)
+
+        def cold(url=url):
+            new_app.CANVAS_CACHE.clear()
+            new_app.LAYOUT_CACHE.clear()
+            new_app.SHARED_CACHE.clear()
+            get(client, url)()
+        results[f'GET {url} cold[{label}]'] = measure(cold, repeat)
+
+    results[f'app GET /api/tree/me[{label}]'] = measure(get(client, '/api/tree/me'), repeat)
+    since = new_app.HISTORY.latest(username)
+    edited = dict(family, people=family['people'] + [{'id': 'bench_new', 'name': 'Bench New', 'born': '2000'}])
+    new_app.save_user_family(username, edited, 'Bench edit')
+    changes = f'/api/tree/me/changes?since={since}&family={username}'
+    results[f'app GET /api/tree/me/changes one edit[{label}]'] = measure(get(client, changes), repeat)
+
+    old_client = old_app.app.test_client()
+    with old_app.db_connect() as con:
+        cur = con.execute(
+            'INSERT INTO users (email, password_hash) VALUES (?, ?)', (f'{username}@bench.local', 'x'),
+        )
+        uid = int(cur.lastrowid)
+        con.commit()
+    old_path = old_app.user_family_file(uid)
+    old_path.parent.mkdir(parents=True, exist_ok=True)
+    old_path.write_text(json.dumps(family, indent=2), encoding='utf-8')
+    with old_client.session_transaction() as sess:
+        sess['user_id'] = uid
+    results[f'GET /api/tree/me[{label}]'] = measure(get(old_client, '/api/tree/me'), repeat)
+    return results
+
+
+def bench_startup(data_dir: Path, repeat: int) -> dict:
+    """Cold interpreter import of each app, plus app_old's one-time init phase, in fresh subprocesses."""
+    # app.py always uses the repo's data/, so only app_old (which honours DATA_DIR) runs init_storage() here.
+    script = (
+        'import sys, time; t = time.perf_counter(); m = __import__(sys.argv[1]); i = time.perf_counter();'
+        ' sys.argv[2:] and m.init_storage(); print(i - t, time.perf_counter() - i)'
+    )
+    env = dict(os.environ, DATA_DIR=str(data_dir / 'startup'))
+    results = {}
+    for module, init in (('app', False), ('app_old', True)):
+        imports, inits = [], []
+        for _ in range(max(3, min(repeat, 7))):
+            args = [sys.executable, '-c', script, module] + (['init'] if init else [])
+            imported, initialized = (float(v) * 1000 for v in subprocess.check_output(
+                args, cwd=REPO_DIR, env=env, text=True).split())
+            imports.append(imported)
+            inits.append(initialized)
+        series = [(f'startup import {module}', imports)]
+        if init:
+            series.append((f'startup init_storage {module}', inits))
+        for name, samples in series:
+            samples.sort()
+            results[name] = {
+                'unit': 'ms',
+                'runs': len(samples),
+                'min': round(samples[0], 4),
+                'median': round(statistics.median(samples), 4),
+                'mean': round(statistics.fmean(samples), 4),
+                'p95': round(samples[-1], 4),
+                'stdev': round(statistics.stdev(samples), 4),
+            }
+    return results
+
+
+def run(sizes: list[int], repeat: int, depth: int, branching: float, spouse_density: float,
+        multi_marriage_rate: float, seed: int) -> dict:
+    with tempfile.TemporaryDirectory(prefix='lineagemap-bench-') as tmp:
+        data_dir = Path(tmp)
+        new_app, old_app = load_apps(data_dir)
+        results: dict[str, dict] = {}
+        shapes = []
+        for size in sizes:
+            shape = FamilyShape(size=size, depth=depth, branching=branching, spouse_density=spouse_density,
+                                multi_marriage_rate=multi_marriage_rate, seed=seed)
+            shapes.append(asdict(shape) | {'label': shape.label()})
+            family = generate_family(shape)
+            label = f'n{size}'
+            print(f'  {shape.label()}: {len(family["people"])} people, {len(family["relationships"])} relationships')
+            results.update(bench_functions(new_app, old_app, family, data_dir, label, repeat))
+            results.update(bench_endpoints(new_app, old_app, family, label, repeat))
+
+        results.update(bench_startup(data_dir, repeat))
+        client = old_app.app.test_client()
+        for sample_id in SAMPLE_IDS:
+            url = f'/api/sample/{sample_id}/tree'
+            results[f'GET {url}'] = measure(lambda url=url: client.get(url), repeat)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'shapes': shapes,
+        },
+        'results': results,
+    }
+
+
+def compare(old_path: Path, new_path: Path, threshold: float) -> int:
+    old = json.loads(old_path.read_text(encoding='utf-8'))['results']
+    new = json.loads(new_path.read_text(encoding='utf-8'))['results']
+    regressions = 0
+    width = max((len(name) for name in new), default=10)
+    print(f'{"benchmark":<{width}}  {"old ms":>10}  {"new ms":>10}  {"change":>8}')
+    for name in sorted(set(old) | set(new)):
+        if name not in old or name not in new:
+            print(f'{name:<{width}}  {"(only in " + ("new" if name in new else "old") + ")":>32}')
+            continue
+        before, after = old[name]['median'], new[name]['median']
+        change = (after - before) / before if before else 0.0
+        flag = ''
+        if change > threshold:
+            regressions += 1
+            flag = '  REGRESSION'
+        print(f'{name:<{width}}  {before:>10.3f}  {after:>10.3f}  {change:>+7.1%}{flag}')
+    return 1 if regressions else 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command')
+
+    cmp_parser = sub.add_parser('compare', help='compare two result files by median')
+    cmp_parser.add_argument('old', type=Path)
+    cmp_parser.add_argument('new', type=Path)
+    cmp_parser.add_argument('--threshold', type=float, default=0.10, help='relative slowdown reported as regression')
+
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES))
+    parser.add_argument('--repeat', type=int, default=15)
+    parser.add_argument('--depth', type=int, default=6)
+    parser.add_argument('--branching', type=float, default=2.5)
+    parser.add_argument('--spouse-density', type=float, default=0.7)
+    parser.add_argument('--multi-marriage-rate', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', type=Path, help='result file (default benchmarks/results/<timestamp>.json)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        return compare(args.old, args.new, args.threshold)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    print(f'Running benchmarks for sizes {sizes} ({args.repeat} runs each)')
+    report = run(sizes, args.repeat, args.depth, args.branching, args.spouse_density,
+                 args.multi_marriage_rate, args.seed)
+
+    output = args.output or RESULTS_DIR / f'{datetime.now().strftime("%Y%m%d-%H%M%S")}-{report["meta"]["git_revision"] or "local"}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding='utf-8')
+
+    width = max(len(name) for name in report['results'])
+    for name, stats in report['results'].items():
+        print(f'{name:<{width}}  median {stats["median"]:>9.3f} ms  p95 {stats["p95"]:>9.3f} ms')
+    print(f'Wrote {output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Synthetic family generator for benchmarks.
+
+Produces families in the app.py JSON schema:
+    people:        {id, name, born, died, photo}
+    relationships: {type: 'spouse', a, b} and {parent, child}
+"""
+
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+
+FIRST_NAMES = (
+    'Ada', 'Bran', 'Cora', 'Dev', 'Edda', 'Finn', 'Gia', 'Hugo', 'Iris', 'Jon', 'Kira', 'Leo',
+    'Mara', 'Nils', 'Orla', 'Pax', 'Quin', 'Rosa', 'Sami', 'Tess', 'Ugo', 'Vera', 'Wren', 'Xan',
+)
+SURNAMES = ('Ashby', 'Brandt', 'Castellan', 'Dunmore', 'Everly', 'Farrow', 'Grey', 'Holt')
+
+
+@dataclass(frozen=True)
+class FamilyShape:
+    size: int = 200
+    depth: int = 6
+    branching: float = 2.5
+    spouse_density: float = 0.7
+    multi_marriage_rate: float = 0.05
+    seed: int = 1
+
+    def label(self) -> str:
+        return f'n{self.size}-d{self.depth}-b{self.branching:g}-s{self.spouse_density:g}-m{self.multi_marriage_rate:g}'
+
+
+def generate_family(shape: FamilyShape) -> dict:
+    rng = random.Random(shape.seed)
+    people: list[dict] = []
+    relationships: list[dict] = []
+
+    def new_person(generation: int) -> str:
+        pid = f'p{len(people):05d}'
+        born = 1800 + generation * 28 + rng.randint(-4, 4)
+        people.append({
+            'id': pid,
+            'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)} {len(people)}',
+            'born': str(born),
+            'died': str(born + rng.randint(40, 95)) if generation < shape.depth - 2 else '',
+            'photo': '/static/img/placeholder-avatar.png',
+        })
+        return pid
+
+    def marry(pid: str, generation: int) -> list[str]:
+        spouses = []
+        if len(people) < shape.size and rng.random() < shape.spouse_density:
+            spouses.append(new_person(generation))
+            if len(people) < shape.size and rng.random() < shape.multi_marriage_rate:
+                spouses.append(new_person(generation))
+        for spouse in spouses:
+            relationships.append({'type': 'spouse', 'a': pid, 'b': spouse})
+        return spouses
+
+    generation = 0
+    current = [new_person(0)]
+    while len(people) < shape.size:
+        next_gen: list[str] = []
+        for pid in current:
+            if len(people) >= shape.size:
+                break
+            for spouse in marry(pid, generation) or [None]:
+                if generation + 1 >= shape.depth:
+                    continue
+                low = max(0, int(shape.branching) - 1)
+                for _ in range(rng.randint(low, int(shape.branching + 1.5))):
+                    if len(people) >= shape.size:
+                        break
+                    child = new_person(generation + 1)
+                    relationships.append({'parent': pid, 'child': child})
+                    if spouse is not None:
+                        relationships.append({'parent': spouse, 'child': child})
+                    next_gen.append(child)
+        if next_gen:
+            current = next_gen
+            generation += 1
+        else:
+            # Line died out or hit max depth: start a new root branch.
+            generation = 0
+            current = [new_person(0)]
+
+    return {
+        'meta': {'family_name': f'Synthetic {shape.label()}', 'profile_name': 'Bench', 'synthetic': True},
+        'people': people,
+        'relationships': relationships,
+        'events': [],
+    }
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable
+
+
+def _default_size(value: Any) -> int:
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 1
+
+
+class BoundedCache:
+    """In-process LRU cache bounded by entry count and approximate byte size."""
+
+    def __init__(self, name: str, max_entries: int = 256, max_bytes: int = 32 * 1024 * 1024,
+                 sizeof: Callable[[Any], int] = _default_size):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class SharedCache:
+    """
+    Cross-process cache in a local SQLite file (WAL), for values every worker would otherwise rebuild.
+
+    One row per key holding the latest (version, value); a lookup only hits when the stored
+    version matches, and put() overwrites older versions in place. Values are text, stored
+    zlib-compressed. Once the table outgrows max_bytes the least recently used rows are dropped.
+    Errors (locked or unwritable file) degrade to cache misses, never to failed requests.
+    """
+
+    TOUCH_INTERVAL = 60.0
+    PRUNE_EVERY = 64
+
+    def __init__(self, name: str, db_path: Path, max_bytes: int = 256 * 1024 * 1024):
+        self.name = name
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._puts = 0
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        con = getattr(self._local, 'con', None)
+        # Connections must not cross a fork (gunicorn workers, job processes).
+        if con is not None and self._local.pid == os.getpid():
+            return con
+        con = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+        con.execute('PRAGMA journal_mode = WAL')
+        con.execute('PRAGMA synchronous = NORMAL')
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+              key TEXT PRIMARY KEY,
+              version TEXT NOT NULL,
+              value BLOB NOT NULL,
+              size INTEGER NOT NULL,
+              accessed REAL NOT NULL
+            )
+            """
+        )
+        con.execute('CREATE INDEX IF NOT EXISTS entries_accessed_idx ON entries (accessed)')
+        self._local.con = con
+        self._local.pid = os.getpid()
+        return con
+
+    def get(self, key: str, version: str) -> str | None:
+        try:
+            con = self._connect()
+            row = con.execute('SELECT version, value, accessed FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or row[0] != version:
+                self.misses += 1
+                return None
+            now = time.time()
+            if now - row[2] > self.TOUCH_INTERVAL:
+                con.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        except sqlite3.Error:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return zlib.decompress(row[1]).decode('utf-8')
+
+    def put(self, key: str, version: str, value: str) -> None:
+        blob = zlib.compress(value.encode('utf-8'), 3)
+        if len(blob) > self.max_bytes:
+            return
+        try:
+            con = self._connect()
+            con.execute(
+                'INSERT OR REPLACE INTO entries (key, version, value, size, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, version, blob, len(blob), time.time()),
+            )
+            self._puts += 1
+            if self._puts % self.PRUNE_EVERY == 0:
+                self.prune()
+        except sqlite3.Error:
+            pass
+
+    def prune(self) -> int:
+        con = self._connect()
+        total = con.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        dropped = 0
+        # Trim to 90% so a full cache does not prune on every put.
+        for key, size in con.execute('SELECT key, size FROM entries ORDER BY accessed').fetchall():
+            if total <= self.max_bytes * 0.9:
+                break
+            con.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+            dropped += 1
+        self.evictions += dropped
+        return dropped
+
+    def discard(self, key: str) -> None:
+        try:
+            self._connect().execute('DELETE FROM entries WHERE key = ?', (key,))
+        except sqlite3.Error:
+            pass
+
+    def clear(self) -> None:
+        self._connect().execute('DELETE FROM entries')
+
+    def stats(self) -> dict:
+        try:
+            entries, size = self._connect().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        except sqlite3.Error:
+            entries, size = 0, 0
+        lookups = self.hits + self.misses
+        return {
+            'name': self.name,
+            'entries': entries,
+            'bytes': size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
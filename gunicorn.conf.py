@@ -0,0 +1,20 @@
+"""
+gunicorn settings: `gunicorn -c gunicorn.conf.py` (app.py) or LINEAGEMAP_WSGI=app_old:app for the legacy app.
+
+One-time storage setup (directories, users DB migrations, sample seeding) runs once in the
+master via on_starting, so forked workers boot without repeating it.
+"""
+
+import importlib
+import os
+
+wsgi_app = os.environ.get('LINEAGEMAP_WSGI', 'app:app')
+bind = os.environ.get('LINEAGEMAP_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('LINEAGEMAP_WORKERS', '2'))
+preload_app = True
+
+
+def on_starting(server):
+    module = importlib.import_module(wsgi_app.split(':', 1)[0])
+    elapsed = module.init_storage()
+    server.log.info('Storage initialized in %.1f ms', elapsed * 1000)
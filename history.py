@@ -0,0 +1,323 @@
+"""
+Family version history with structural sharing.
+
+Every saved family becomes a version. Its people, relationships and events are stored once each
+as content-addressed objects in DATA_DIR/history.db; a version is only a manifest listing
+(identity, object hash) pairs, so an edit that touches one person adds one object plus a
+manifest instead of a full copy. Diffs compare manifests and only load objects that differ.
+
+Identities: people and events by `id`, relationships by type plus endpoints (model.KEY_STYLES).
+
+family_json_response() and family_changes_response() are the /api/tree/me and
+/api/tree/me/changes view bodies both apps share (static/js/familySync.js is the client).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from flask import current_app, jsonify, request, url_for
+
+from metrics import timed
+from model import KEY_STYLES
+
+COLLECTIONS = ('people', 'relationships', 'events')
+
+
+def _canonical(value) -> str:
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:20]
+
+
+def identity(collection: str, item) -> str:
+    if not isinstance(item, dict):
+        return '#' + _hash(_canonical(item))
+    if collection == 'relationships':
+        ends = [f'{s}={item[s]}|{t}={item[t]}' for s, t in KEY_STYLES if s in item and t in item]
+        if ends:
+            return f'{item.get("type", "")}:{ends[0]}'
+    elif isinstance(item.get('id'), str):
+        return item['id']
+    return '#' + _hash(_canonical(item))
+
+
+def indexed(pairs) -> dict[str, str]:
+    """
+    Map identity -> object hash for a manifest collection. Repeated identities (duplicate rows
+    from older saves) get an occurrence suffix, ``ident#2``, ``ident#3``..., so none are collapsed.
+    """
+    seen: dict[str, int] = {}
+    out: dict[str, str] = {}
+    for ident, digest in pairs:
+        seen[ident] = seen.get(ident, 0) + 1
+        out[ident if seen[ident] == 1 else f'{ident}#{seen[ident]}'] = digest
+    return out
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+class VersionNotFound(LookupError):
+    pass
+
+
+class FamilyHistory:
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._sources: dict[str, tuple] = {}
+        self._sources_lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        con = getattr(self._local, 'con', None)
+        if con is not None and self._local.pid == os.getpid():
+            return con
+        con = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        con.execute('PRAGMA journal_mode = WAL')
+        con.execute('CREATE TABLE IF NOT EXISTS objects (hash TEXT PRIMARY KEY, body BLOB NOT NULL)')
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS versions (
+              family_key TEXT NOT NULL,
+              version INTEGER NOT NULL,
+              manifest BLOB NOT NULL,
+              message TEXT NOT NULL DEFAULT '',
+              people INTEGER NOT NULL DEFAULT 0,
+              relationships INTEGER NOT NULL DEFAULT 0,
+              created_at TEXT NOT NULL,
+              PRIMARY KEY (family_key, version)
+            )
+            """
+        )
+        self._local.con = con
+        self._local.pid = os.getpid()
+        return con
+
+    # ---- writing ----
+
+    def _manifest(self, family: dict) -> tuple[dict, dict[str, str]]:
+        objects: dict[str, str] = {}
+
+        def put(value) -> str:
+            text = _canonical(value)
+            digest = _hash(text)
+            objects[digest] = text
+            return digest
+
+        manifest: dict = {'keys': list(family)}
+        for key, value in family.items():
+            if key in COLLECTIONS and isinstance(value, list):
+                manifest[key] = [[identity(key, item), put(item)] for item in value]
+            else:
+                manifest.setdefault('other', {})[key] = put(value)
+        return manifest, objects
+
+    def record(self, family_key: str, family: dict, message: str = '') -> int:
+        """Store ``family`` as the next version; an unchanged family returns the current version."""
+        manifest, objects = self._manifest(family)
+        blob = zlib.compress(_canonical(manifest).encode('utf-8'), 6)
+        con = self.connect()
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            row = con.execute(
+                'SELECT version, manifest FROM versions WHERE family_key = ? ORDER BY version DESC LIMIT 1',
+                (family_key,),
+            ).fetchone()
+            if row is not None and row[1] == blob:
+                con.execute('COMMIT')
+                return row[0]
+            con.executemany(
+                'INSERT OR IGNORE INTO objects (hash, body) VALUES (?, ?)',
+                [(digest, zlib.compress(text.encode('utf-8'), 6)) for digest, text in objects.items()],
+            )
+            version = (row[0] if row else 0) + 1
+            con.execute(
+                'INSERT INTO versions (family_key, version, manifest, message, people, relationships, created_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (family_key, version, blob, message, len(manifest.get('people', [])),
+                 len(manifest.get('relationships', [])), _now()),
+            )
+            con.execute('COMMIT')
+            return version
+        except BaseException:
+            con.execute('ROLLBACK')
+            raise
+
+    def current(self, family_key: str, source, family: dict) -> int:
+        """
+        Version of ``family`` as served now. ``source`` identifies where its content came from (file
+        path plus mtime/size, a shared base); when it differs from what this process saw last, the
+        family is recorded, a no-op if the content is unchanged. Families that change without a save
+        (shared bases updated by a deploy, files edited by hand) therefore still get a new version.
+        """
+        with self._sources_lock:
+            known = self._sources.get(family_key)
+        if known is not None and known[0] == source:
+            return known[1]
+        message = 'Changed on disk' if known is not None or self.latest(family_key) else 'Initial version'
+        version = self.record(family_key, family, message)
+        with self._sources_lock:
+            self._sources[family_key] = (source, version)
+        return version
+
+    # ---- reading ----
+
+    def latest(self, family_key: str) -> int | None:
+        row = self.connect().execute(
+            'SELECT MAX(version) FROM versions WHERE family_key = ?', (family_key,),
+        ).fetchone()
+        return row[0]
+
+    def versions(self, family_key: str, limit: int = 50) -> list[dict]:
+        rows = self.connect().execute(
+            'SELECT version, message, people, relationships, created_at FROM versions'
+            ' WHERE family_key = ? ORDER BY version DESC LIMIT ?',
+            (family_key, limit),
+        ).fetchall()
+        return [
+            {'version': v, 'message': m, 'people': p, 'relationships': r, 'created_at': c}
+            for v, m, p, r, c in rows
+        ]
+
+    def _load_manifest(self, family_key: str, version: int) -> dict:
+        row = self.connect().execute(
+            'SELECT manifest FROM versions WHERE family_key = ? AND version = ?', (family_key, version),
+        ).fetchone()
+        if row is None:
+            raise VersionNotFound(f'{family_key} has no version {version}')
+        return json.loads(zlib.decompress(row[0]))
+
+    def _objects(self, hashes) -> dict:
+        wanted = list(set(hashes))
+        found: dict = {}
+        con = self.connect()
+        for start in range(0, len(wanted), 500):
+            chunk = wanted[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            for digest, body in con.execute(f'SELECT hash, body FROM objects WHERE hash IN ({marks})', chunk):
+                found[digest] = json.loads(zlib.decompress(body))
+        return found
+
+    def load(self, family_key: str, version: int) -> dict:
+        manifest = self._load_manifest(family_key, version)
+        hashes = list(manifest.get('other', {}).values())
+        for key in COLLECTIONS:
+            hashes.extend(digest for _, digest in manifest.get(key, []))
+        objects = self._objects(hashes)
+        family = {}
+        for key in manifest['keys']:
+            if key in manifest.get('other', {}):
+                family[key] = objects[manifest['other'][key]]
+            else:
+                family[key] = [objects[digest] for _, digest in manifest[key]]
+        return family
+
+    def diff(self, family_key: str, old: int, new: int) -> dict:
+        """
+        Changes from version ``old`` to ``new``: per collection, the added and changed items (new
+        content) with their identities in ``added_ids``/``changed_ids``, and the identities of
+        removed items; top-level keys such as meta whose content changed are listed under
+        ``changed_keys`` with their new value (None when removed). Identities are occurrence-indexed
+        (see indexed()), so duplicate rows are diffed individually.
+        """
+        before = self._load_manifest(family_key, old)
+        after = self._load_manifest(family_key, new)
+        result: dict = {'from': old, 'to': new}
+        pending: dict = {}
+        for key in COLLECTIONS:
+            old_items = indexed(before.get(key, []))
+            new_items = indexed(after.get(key, []))
+            added, changed = [], []
+            for ident, digest in new_items.items():
+                if ident not in old_items:
+                    added.append((ident, digest))
+                elif old_items[ident] != digest:
+                    changed.append((ident, digest))
+            pending[key] = {'added': added, 'changed': changed}
+            result[key] = {'removed': [ident for ident in old_items if ident not in new_items]}
+        old_other, new_other = before.get('other', {}), after.get('other', {})
+        changed_keys = {
+            k: new_other.get(k) for k in set(old_other) | set(new_other) if old_other.get(k) != new_other.get(k)
+        }
+
+        wanted = [d for d in changed_keys.values() if d]
+        for key in COLLECTIONS:
+            wanted += [digest for field in ('added', 'changed') for _, digest in pending[key][field]]
+        objects = self._objects(wanted)
+        for key in COLLECTIONS:
+            for field in ('added', 'changed'):
+                result[key][field] = [objects[digest] for _, digest in pending[key][field]]
+                result[key][f'{field}_ids'] = [ident for ident, _ in pending[key][field]]
+        result['changed_keys'] = {k: objects[d] if d else None for k, d in changed_keys.items()}
+        return result
+
+    def changes(self, family_key: str, since: int, current: int) -> dict:
+        """
+        Delta-sync answer for a client holding version ``since`` of a family now at ``current``:
+        ``{'version', 'since', 'full': False, <collections>, 'changed_keys'}``, or ``'full': True``
+        when ``since`` is unknown or the delta removes items that have no stable identity. Callers
+        attach ``family`` to full answers. Version 0 is what a family served before its first
+        record(); version 1 holds the same content.
+        """
+        payload = {'version': current, 'since': since, 'full': True}
+        if not 0 <= since < current:
+            return payload
+        base = max(since, 1)
+        if base == current:
+            delta = {name: {'added': [], 'changed': [], 'removed': [], 'added_ids': [], 'changed_ids': []}
+                     for name in COLLECTIONS}
+            delta['changed_keys'] = {}
+        else:
+            delta = self.diff(family_key, base, current)
+            # Items without a stable identity cannot be patched client-side.
+            if any(ident.startswith('#') for name in COLLECTIONS for ident in delta[name]['removed']):
+                return payload
+        payload.update({name: delta[name] for name in COLLECTIONS}, changed_keys=delta['changed_keys'], full=False)
+        return payload
+
+
+def family_sync_headers(response, family_key: str, version: int):
+    response.headers['X-Family-Version'] = str(version)
+    # The family key in the URL keeps one browser's cached copy from being patched with another account's deltas.
+    response.headers['X-Family-Changes'] = url_for('api_tree_me_changes', family=family_key)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def family_json_response(family_key: str, version: int, family: dict):
+    """The family with its sync headers and a weak ETag; a matching If-None-Match gets a 304."""
+    with timed('serialize'):
+        response = jsonify(family)
+    response.set_etag(f'{family_key}-v{version}', weak=True)
+    return family_sync_headers(response.make_conditional(request), family_key, version)
+
+
+def family_changes_response(history: FamilyHistory, family_key: str, version: int, load_family: Callable[[], dict]):
+    """Answer ``?since=<n>&family=<key>``: 304 when current, else a delta, or the full family from ``load_family``."""
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'error': 'since is required'}), 400
+    if request.args.get('family', family_key) != family_key:
+        payload = {'version': version, 'since': since, 'full': True}
+    elif since == version:
+        return family_sync_headers(current_app.response_class(status=304), family_key, version)
+    else:
+        with timed('diff'):
+            payload = history.changes(family_key, since, version)
+    if payload['full']:
+        payload['family'] = load_family()
+    with timed('serialize'):
+        response = jsonify(payload)
+    return family_sync_headers(response, family_key, version)
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+from cache import BoundedCache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; portraits fall back to the original file.
+    Image = None
+    ImageOps = None
+
+log = logging.getLogger(__name__)
+
+# Width buckets in CSS pixels; cards render at ~82px, so 96 covers 1x and 192/384 cover dense screens.
+THUMB_SIZES = (96, 192, 384)
+DEFAULT_THUMB_WIDTH = 96
+
+# (source path, mtime_ns, size) -> thumbnail descriptor dict, or None if the source cannot be thumbnailed.
+THUMB_MANIFEST = BoundedCache('thumbnails', max_entries=20000)
+_generate_lock = threading.Lock()
+_MISSING = object()
+
+
+class ThumbnailPipeline:
+    def __init__(self, static_dir: Path, static_url: str = '/static', subdir: str = 'thumbs'):
+        self.static_dir = static_dir
+        self.static_url = static_url.rstrip('/')
+        self.subdir = subdir
+        self.out_dir = static_dir / subdir
+        self._pending: dict[str, None] = {}
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def source_path(self, photo_url: str) -> Path | None:
+        prefix = self.static_url + '/'
+        if not photo_url or not photo_url.startswith(prefix):
+            return None
+        relative = photo_url[len(prefix):]
+        path = (self.static_dir / relative).resolve()
+        if self.static_dir.resolve() not in path.parents or path.parent == self.out_dir.resolve():
+            return None
+        return path
+
+    def _manifest_key(self, photo_url: str) -> tuple | None:
+        if Image is None:
+            return None
+        path = self.source_path(photo_url)
+        if path is None:
+            return None
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        return (str(path), st.st_mtime_ns, st.st_size)
+
+    def thumbnails_for(self, photo_url: str) -> dict | None:
+        """Return ``{'src', 'srcset', 'webp_srcset'}`` for a /static photo URL, generating files on first use."""
+        key = self._manifest_key(photo_url)
+        if key is None:
+            return None
+        cached = self._known(key)
+        if cached is not _MISSING:
+            return cached
+
+        try:
+            thumbs = self._generate(Path(key[0]))
+        except Exception:
+            log.exception('thumbnail generation failed for %s', key[0])
+            thumbs = None
+        self._write_manifest(key, thumbs)
+        THUMB_MANIFEST.put(key, thumbs)
+        return thumbs
+
+    def lookup(self, photo_url: str) -> dict | None:
+        """Like thumbnails_for() but never generates inline: a miss queues the photo and returns None."""
+        key = self._manifest_key(photo_url)
+        if key is None:
+            return None
+        cached = self._known(key)
+        if cached is _MISSING:
+            self.queue(photo_url)
+            return None
+        return cached
+
+    def ready(self, photo_url: str) -> bool:
+        """True once lookup() has a final answer for the photo (thumbnails, or none possible)."""
+        key = self._manifest_key(photo_url)
+        return key is None or self._known(key) is not _MISSING
+
+    def _manifest_file(self, key: tuple) -> Path:
+        return self.out_dir / 'manifest' / f"{hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:20]}.json"
+
+    def _known(self, key: tuple):
+        """Descriptor for ``key`` from this process or from the on-disk manifest any process wrote; _MISSING if neither."""
+        cached = THUMB_MANIFEST.get(key, _MISSING)
+        if cached is _MISSING:
+            try:
+                cached = json.loads(self._manifest_file(key).read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                return _MISSING
+            THUMB_MANIFEST.put(key, cached)
+        return cached
+
+    def _write_manifest(self, key: tuple, thumbs: dict | None) -> None:
+        # Written after the image files, so a manifest on disk means its thumbnails exist.
+        dst = self._manifest_file(key)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_name(f'.{dst.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp.write_text(json.dumps(thumbs), encoding='utf-8')
+        os.replace(tmp, dst)
+
+    def queue(self, photo_url: str) -> None:
+        with self._cond:
+            if photo_url in self._pending:
+                return
+            self._pending[photo_url] = None
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='thumbnail-generator', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                photo_url = next(iter(self._pending))
+            self.thumbnails_for(photo_url)
+            with self._cond:
+                self._pending.pop(photo_url, None)
+
+    def _generate(self, path: Path) -> dict | None:
+        digest = hashlib.sha1(path.read_bytes()).hexdigest()[:16]
+        with Image.open(path) as opened:
+            image = ImageOps.exif_transpose(opened)
+            image.load()
+
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        fallback_ext = 'png' if has_alpha else 'jpg'
+        # Never upscale: buckets wider than the source collapse into one at its native width.
+        widths = [w for w in THUMB_SIZES if w < image.width]
+        if len(widths) < len(THUMB_SIZES):
+            widths.append(image.width)
+
+        urls: dict[str, list[tuple[int, str]]] = {'webp': [], fallback_ext: []}
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        with _generate_lock:
+            for width in widths:
+                height = max(1, round(image.height * width / image.width))
+                resized = None
+                for ext in ('webp', fallback_ext):
+                    name = f'{digest}-{width}.{ext}'
+                    dst = self.out_dir / name
+                    if not dst.exists():
+                        if resized is None:
+                            resized = image.resize((width, height), Image.LANCZOS)
+                        self._save(resized, dst, ext)
+                    urls[ext].append((width, f'{self.static_url}/{self.subdir}/{name}'))
+
+        fallback = urls[fallback_ext]
+        src = next((url for width, url in fallback if width >= DEFAULT_THUMB_WIDTH), fallback[-1][1])
+        return {
+            'src': src,
+            'srcset': ', '.join(f'{url} {width}w' for width, url in fallback),
+            'webp_srcset': ', '.join(f'{url} {width}w' for width, url in urls['webp']),
+        }
+
+    @staticmethod
+    def _save(image, dst: Path, ext: str) -> None:
+        tmp = dst.with_name(f'.{dst.name}.{os.getpid()}.tmp')
+        if ext == 'webp':
+            image.save(tmp, 'WEBP', quality=80, method=4)
+        elif ext == 'png':
+            image.save(tmp, 'PNG', optimize=True)
+        else:
+            image.convert('RGB').save(tmp, 'JPEG', quality=82, optimize=True, progressive=True)
+        os.replace(tmp, dst)
@@ -0,0 +1,298 @@
+"""
+Local background jobs: a SQLite-backed queue plus a pool of worker processes.
+
+- No broker: the queue is a table in DATA_DIR/jobs.db (WAL mode), shared by web and worker processes.
+- Per-family serialization: a job is only claimed when no other job for the same family_key is running.
+- Tasks register with @task('name') and report progress through JobContext.progress().
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sqlite3
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+log = logging.getLogger(__name__)
+
+TASKS: dict[str, Callable[['JobContext'], Any]] = {}
+
+# A running job whose heartbeat is older than this is assumed to belong to a dead worker.
+STALE_AFTER_SECONDS = 300
+# run_one() refreshes updated_at this often while a task runs, even if it reports no progress.
+HEARTBEAT_SECONDS = 30
+
+
+def task(name: str):
+    def register(fn: Callable[['JobContext'], Any]):
+        TASKS[name] = fn
+        return fn
+    return register
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+
+
+class JobContext:
+    def __init__(self, queue: 'JobQueue', job: dict):
+        self.queue = queue
+        self.job = job
+        self.id = job['id']
+        self.family_key = job['family_key']
+        self.payload = job['payload']
+
+    def progress(self, fraction: float, message: str = '') -> None:
+        self.queue.set_progress(self.id, fraction, message)
+
+
+class JobQueue:
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._initialized = False
+
+    def connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        con.execute('PRAGMA busy_timeout = 30000')
+        if not self._initialized:
+            self._init(con)
+        return con
+
+    def _init(self, con: sqlite3.Connection) -> None:
+        con.execute('PRAGMA journal_mode = WAL')
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              kind TEXT NOT NULL,
+              family_key TEXT NOT NULL,
+              owner TEXT NOT NULL DEFAULT '',
+              payload TEXT NOT NULL DEFAULT '{}',
+              status TEXT NOT NULL DEFAULT 'queued',
+              progress REAL NOT NULL DEFAULT 0,
+              message TEXT NOT NULL DEFAULT '',
+              result TEXT,
+              error TEXT,
+              worker TEXT NOT NULL DEFAULT '',
+              created_at TEXT NOT NULL,
+              started_at TEXT,
+              updated_at TEXT NOT NULL,
+              finished_at TEXT
+            )
+            """
+        )
+        con.execute('CREATE INDEX IF NOT EXISTS jobs_status_idx ON jobs (status, id)')
+        con.execute('CREATE INDEX IF NOT EXISTS jobs_family_idx ON jobs (family_key, status)')
+        con.execute('CREATE INDEX IF NOT EXISTS jobs_owner_idx ON jobs (owner, id)')
+        self._initialized = True
+
+    @staticmethod
+    def _row(row: sqlite3.Row | None) -> dict | None:
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'] or '{}')
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def enqueue(self, kind: str, family_key: str, payload: dict | None = None, owner: str = '') -> int:
+        if kind not in TASKS:
+            raise ValueError(f'Unknown job kind: {kind}')
+        now = _now()
+        con = self.connect()
+        try:
+            cur = con.execute(
+                'INSERT INTO jobs (kind, family_key, owner, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (kind, family_key, owner, json.dumps(payload or {}), now, now),
+            )
+            return int(cur.lastrowid)
+        finally:
+            con.close()
+
+    def get(self, job_id: int) -> dict | None:
+        con = self.connect()
+        try:
+            return self._row(con.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+        finally:
+            con.close()
+
+    def list_for_owner(self, owner: str, limit: int = 20) -> list[dict]:
+        con = self.connect()
+        try:
+            rows = con.execute('SELECT * FROM jobs WHERE owner = ? ORDER BY id DESC LIMIT ?', (owner, limit)).fetchall()
+            return [self._row(row) for row in rows]
+        finally:
+            con.close()
+
+    def claim(self, worker: str) -> dict | None:
+        """Atomically take the oldest queued job whose family has nothing running."""
+        con = self.connect()
+        try:
+            con.execute('BEGIN IMMEDIATE')
+            row = con.execute(
+                """
+                SELECT j.id FROM jobs j
+                WHERE j.status = 'queued'
+                  AND NOT EXISTS (
+                    SELECT 1 FROM jobs r WHERE r.family_key = j.family_key AND r.status = 'running'
+                  )
+                ORDER BY j.id LIMIT 1
+                """
+            ).fetchone()
+            if row is None:
+                con.execute('COMMIT')
+                return None
+            now = _now()
+            con.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, started_at = ?, updated_at = ? WHERE id = ?",
+                (worker, now, now, row['id']),
+            )
+            job = self._row(con.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone())
+            con.execute('COMMIT')
+            return job
+        except Exception:
+            con.execute('ROLLBACK')
+            raise
+        finally:
+            con.close()
+
+    def set_progress(self, job_id: int, fraction: float, message: str = '') -> None:
+        con = self.connect()
+        try:
+            con.execute(
+                'UPDATE jobs SET progress = ?, message = ?, updated_at = ? WHERE id = ?',
+                (max(0.0, min(1.0, float(fraction))), message, _now(), job_id),
+            )
+        finally:
+            con.close()
+
+    def heartbeat(self, job_id: int, worker: str) -> None:
+        con = self.connect()
+        try:
+            con.execute(
+                "UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running' AND worker = ?",
+                (_now(), job_id, worker),
+            )
+        finally:
+            con.close()
+
+    # finish() and fail() only touch the row while `worker` still owns it, so a run that lost its
+    # claim (requeued as stale, then picked up elsewhere) cannot overwrite the newer run's status.
+
+    def finish(self, job_id: int, result: Any, worker: str) -> None:
+        now = _now()
+        con = self.connect()
+        try:
+            con.execute(
+                "UPDATE jobs SET status = 'done', progress = 1, result = ?, updated_at = ?, finished_at = ?"
+                " WHERE id = ? AND status = 'running' AND worker = ?",
+                (json.dumps(result), now, now, job_id, worker),
+            )
+        finally:
+            con.close()
+
+    def fail(self, job_id: int, error: str, worker: str) -> None:
+        now = _now()
+        con = self.connect()
+        try:
+            con.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ?, finished_at = ?"
+                " WHERE id = ? AND status = 'running' AND worker = ?",
+                (error, now, now, job_id, worker),
+            )
+        finally:
+            con.close()
+
+    def requeue_stale(self, older_than: float = STALE_AFTER_SECONDS) -> int:
+        cutoff = datetime.fromtimestamp(time.time() - older_than, timezone.utc).isoformat(timespec='milliseconds')
+        con = self.connect()
+        try:
+            cur = con.execute(
+                "UPDATE jobs SET status = 'queued', worker = '', message = 'requeued after worker loss' "
+                "WHERE status = 'running' AND updated_at < ?",
+                (cutoff,),
+            )
+            return cur.rowcount
+        finally:
+            con.close()
+
+    def run_one(self, worker: str) -> bool:
+        job = self.claim(worker)
+        if job is None:
+            return False
+        ctx = JobContext(self, job)
+        # Tasks may go quiet for minutes (a large layout, writing an export); the heartbeat keeps
+        # requeue_stale() from handing a job that is still running to another worker.
+        stop = threading.Event()
+        beat = threading.Thread(target=self._beat, args=(job['id'], worker, stop),
+                                name=f"job-{job['id']}-heartbeat", daemon=True)
+        beat.start()
+        try:
+            result = TASKS[job['kind']](ctx)
+        except Exception:
+            log.exception('job %s (%s) failed', job['id'], job['kind'])
+            self.fail(job['id'], traceback.format_exc(limit=5), worker)
+        else:
+            self.finish(job['id'], result, worker)
+        finally:
+            stop.set()
+            beat.join()
+        return True
+
+    def _beat(self, job_id: int, worker: str, stop: threading.Event) -> None:
+        while not stop.wait(HEARTBEAT_SECONDS):
+            try:
+                self.heartbeat(job_id, worker)
+            except sqlite3.OperationalError:
+                log.exception('heartbeat for job %s failed', job_id)
+
+
+def _worker_main(db_path: str, poll_interval: float) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    queue = JobQueue(Path(db_path))
+    worker = f'{os.uname().nodename}:{os.getpid()}'
+    while True:
+        try:
+            if not queue.run_one(worker):
+                time.sleep(poll_interval)
+        except sqlite3.OperationalError:
+            log.exception('job queue unavailable; retrying')
+            time.sleep(poll_interval)
+
+
+def run_workers(queue: JobQueue, processes: int = 2, poll_interval: float = 0.5) -> None:
+    """Supervise `processes` worker processes until interrupted, restarting any that die."""
+    queue.requeue_stale()
+    ctx = multiprocessing.get_context('fork')
+    procs: list[multiprocessing.Process] = []
+
+    def spawn():
+        p = ctx.Process(target=_worker_main, args=(str(queue.db_path), poll_interval), daemon=True)
+        p.start()
+        return p
+
+    procs = [spawn() for _ in range(max(1, processes))]
+    try:
+        while True:
+            time.sleep(poll_interval * 4)
+            for i, p in enumerate(procs):
+                if not p.is_alive():
+                    log.warning('job worker %s exited (%s); restarting', p.pid, p.exitcode)
+                    procs[i] = spawn()
+            queue.requeue_stale()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join(timeout=5)
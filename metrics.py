@@ -0,0 +1,219 @@
+"""
+Hot-path instrumentation: stage timers, per-route request counters and latency histograms,
+cache statistics, rendered in Prometheus text format.
+
+Metrics are per process; with several gunicorn workers each worker reports its own numbers
+(the `pid` label on lineagemap_process_info identifies which one answered the scrape).
+"""
+
+from __future__ import annotations
+
+import hmac
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ContextDecorator
+
+from flask import Flask, Response, abort, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOCAL_ADDRS = {'127.0.0.1', '::1', 'localhost'}
+# Set by reverse proxies; a loopback peer carrying one of these is the proxy, not a local scraper.
+PROXY_HEADERS = ('X-Forwarded-For', 'X-Real-IP', 'Forwarded')
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[tuple[str, tuple], float] = {}
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+        self.gauges: dict[tuple[str, tuple], float] = {}
+        self.caches: list = []
+        self.help: dict[str, str] = {}
+
+    def inc(self, name: str, labels: dict | None = None, value: float = 1) -> None:
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: dict | None = None) -> None:
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def set_gauge(self, name: str, value: float, labels: dict | None = None) -> None:
+        with self._lock:
+            self.gauges[(name, tuple(sorted((labels or {}).items())))] = value
+
+    def register_cache(self, cache) -> None:
+        """Export hit/miss/size counters for any object with a BoundedCache-style stats()."""
+        self.caches.append(cache)
+
+    def render(self) -> str:
+        lines: list[str] = []
+
+        def fmt(labels: tuple) -> str:
+            if not labels:
+                return ''
+            inner = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+            return '{' + inner + '}'
+
+        def header(name: str, kind: str, seen: set) -> None:
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self.help:
+                lines.append(f'# HELP {name} {self.help[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        seen: set[str] = set()
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            histograms = [(key, list(h.counts), h.sum, h.count, h.buckets) for key, h in histograms]
+
+        for (name, labels), value in counters:
+            header(name, 'counter', seen)
+            lines.append(f'{name}{fmt(labels)} {value:g}')
+        for (name, labels), value in gauges:
+            header(name, 'gauge', seen)
+            lines.append(f'{name}{fmt(labels)} {value:g}')
+        for (name, labels), counts, total, count, buckets in histograms:
+            header(name, 'histogram', seen)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{fmt(labels + (("le", f"{bound:g}"),))} {cumulative}')
+            lines.append(f'{name}_bucket{fmt(labels + (("le", "+Inf"),))} {count}')
+            lines.append(f'{name}_sum{fmt(labels)} {total:.6f}')
+            lines.append(f'{name}_count{fmt(labels)} {count}')
+
+        cache_stats = [cache.stats() for cache in self.caches]
+        for field, kind in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'),
+                            ('entries', 'gauge'), ('bytes', 'gauge'), ('hit_rate', 'gauge')):
+            name = f'lineagemap_cache_{field}' + ('_total' if kind == 'counter' else '')
+            for stats in cache_stats:
+                header(name, kind, seen)
+                lines.append(f'{name}{fmt((("cache", stats["name"]),))} {stats[field]:g}')
+
+        header('lineagemap_process_info', 'gauge', seen)
+        lines.append(f'lineagemap_process_info{fmt((("pid", str(os.getpid())),))} 1')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = Registry()
+REGISTRY.help.update({
+    'lineagemap_requests_total': 'HTTP requests by route, method and status.',
+    'lineagemap_request_duration_seconds': 'HTTP request latency by route.',
+    'lineagemap_stage_duration_seconds': 'Time spent in instrumented hot-path stages.',
+})
+
+
+class timed(ContextDecorator):
+    """Time a stage (`with timed('layout'):` or `@timed('layout')`) into the registry and Server-Timing."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def _recreate_cm(self):
+        # Fresh instance per decorated call so concurrent/recursive calls keep separate start times.
+        return type(self)(self.stage)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._start
+        REGISTRY.observe('lineagemap_stage_duration_seconds', elapsed, {'stage': self.stage})
+        if has_request_context():
+            timings = g.setdefault('stage_timings', {})
+            timings[self.stage] = timings.get(self.stage, 0.0) + elapsed
+        return False
+
+
+def _route_label() -> str:
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def instrument(app: Flask, server_timing: bool | None = None, endpoint: str = '/metrics') -> None:
+    """Attach request timing, template render timing and a Prometheus endpoint to ``app``."""
+    if server_timing is None:
+        server_timing = os.environ.get('LINEAGEMAP_SERVER_TIMING', '') in ('1', 'true', 'yes')
+    allow_remote = os.environ.get('LINEAGEMAP_METRICS_PUBLIC', '') in ('1', 'true', 'yes')
+    token = os.environ.get('LINEAGEMAP_METRICS_TOKEN', '')
+
+    @app.before_request
+    def _start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = _route_label()
+        REGISTRY.observe('lineagemap_request_duration_seconds', elapsed, {'route': route})
+        REGISTRY.inc('lineagemap_requests_total', {
+            'route': route, 'method': request.method, 'status': str(response.status_code),
+        })
+        if server_timing:
+            parts = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in g.get('stage_timings', {}).items()]
+            parts.append(f'total;dur={elapsed * 1000:.2f}')
+            response.headers['Server-Timing'] = ', '.join(parts)
+        return response
+
+    def _template_started(sender, template, context, **extra):
+        g.setdefault('render_stack', []).append(time.perf_counter())
+
+    def _template_done(sender, template, context, **extra):
+        stack = g.get('render_stack')
+        if not stack:
+            return
+        elapsed = time.perf_counter() - stack.pop()
+        if stack:
+            # Nested render (e.g. a cached fragment); the outer render already includes it.
+            return
+        REGISTRY.observe('lineagemap_stage_duration_seconds', elapsed, {'stage': 'render'})
+        timings = g.setdefault('stage_timings', {})
+        timings['render'] = timings.get('render', 0.0) + elapsed
+
+    before_render_template.connect(_template_started, app, weak=False)
+    template_rendered.connect(_template_done, app, weak=False)
+
+    @app.get(endpoint, endpoint='metrics')
+    def _metrics():
+        if token:
+            scheme, _, supplied = request.headers.get('Authorization', '').partition(' ')
+            if scheme.lower() != 'bearer' or not hmac.compare_digest(supplied.encode(), token.encode()):
+                abort(404)
+        elif not allow_remote and (
+            request.remote_addr not in LOCAL_ADDRS or any(h in request.headers for h in PROXY_HEADERS)
+        ):
+            abort(404)
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,280 @@
+"""
+Compact in-memory family representation.
+
+Families arrive as lists of JSON dicts; for caching many families per worker they are
+converted into slotted objects with interned string ids, relationships stored column-wise
+(integer indices into a shared id table), and array-backed connector coordinates.
+Every structure converts back to the original JSON schema without loss.
+"""
+
+from __future__ import annotations
+
+import sys
+from array import array
+from typing import Any, Iterator
+
+_intern = sys.intern
+
+
+class _Missing:
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return 'MISSING'
+
+
+MISSING = _Missing()
+
+
+def _interned(value):
+    return _intern(value) if isinstance(value, str) else value
+
+
+class Person:
+    __slots__ = ('id', 'name', 'born', 'died', 'photo', 'extra')
+    FIELDS = ('id', 'name', 'born', 'died', 'photo')
+
+    def __init__(self, id, name=MISSING, born=MISSING, died=MISSING, photo=MISSING, extra=None):
+        self.id = id
+        self.name = name
+        self.born = born
+        self.died = died
+        self.photo = photo
+        self.extra = extra
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'Person':
+        extra = {k: v for k, v in data.items() if k not in cls.FIELDS} or None
+        return cls(
+            _interned(data.get('id', MISSING)),
+            data.get('name', MISSING),
+            data.get('born', MISSING),
+            data.get('died', MISSING),
+            # Photo paths repeat across families (placeholders, shared samples).
+            _interned(data.get('photo', MISSING)),
+            extra,
+        )
+
+    def to_json(self) -> dict:
+        out = {}
+        for field in self.FIELDS:
+            value = getattr(self, field)
+            if value is not MISSING:
+                out[field] = value
+        if self.extra:
+            out.update(_copy(self.extra))
+        return out
+
+
+# Key pairs relationships use for their two endpoints, in the order they are recognised.
+KEY_STYLES = (
+    ('a', 'b'),
+    ('parent', 'child'),
+    ('parentId', 'childId'),
+    ('source', 'target'),
+    ('sourceId', 'targetId'),
+)
+
+
+class Relationship:
+    """A read-only view of one relationship row in a CompactFamily."""
+
+    __slots__ = ('type', 'source', 'target', 'source_key', 'target_key', 'extra')
+
+    def __init__(self, type, source, target, source_key, target_key, extra=None):
+        self.type = type
+        self.source = source
+        self.target = target
+        self.source_key = source_key
+        self.target_key = target_key
+        self.extra = extra
+
+    def to_json(self) -> dict:
+        out = {}
+        if self.type is not MISSING:
+            out['type'] = self.type
+        if self.source_key:
+            out[self.source_key] = self.source
+            out[self.target_key] = self.target
+        if self.extra:
+            out.update(_copy(self.extra))
+        return out
+
+
+class CompactFamily:
+    __slots__ = ('keys', 'meta', 'people', 'ids', 'rel_source', 'rel_target', 'rel_style',
+                 'rel_types', 'rel_extra', 'events', 'extra')
+
+    def __init__(self):
+        # Top-level keys in their original order, so to_json() reproduces the document shape.
+        self.keys: tuple[str, ...] = ('people', 'relationships')
+        self.meta: Any = MISSING
+        self.people: list[Person] = []
+        # Shared id table: every id referenced by a relationship, including dangling ones.
+        self.ids: list[str] = []
+        self.rel_source = array('i')
+        self.rel_target = array('i')
+        self.rel_style = bytearray()
+        self.rel_types: list = []
+        self.rel_extra: dict[int, dict] = {}
+        self.events: Any = MISSING
+        self.extra: dict | None = None
+
+    def _id_slot(self, value, ids: dict) -> int:
+        slot = ids.get(value)
+        if slot is None:
+            slot = ids[value] = len(self.ids)
+            self.ids.append(_interned(value))
+        return slot
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'CompactFamily':
+        family = cls()
+        family.keys = tuple(_intern(k) for k in data)
+        family.meta = data.get('meta', MISSING)
+        family.events = data.get('events', MISSING)
+        known = ('meta', 'people', 'relationships', 'events')
+        family.extra = {k: v for k, v in data.items() if k not in known} or None
+
+        people = data.get('people', MISSING)
+        if isinstance(people, list) and all(isinstance(p, dict) for p in people):
+            family.people = [Person.from_json(p) for p in people]
+        elif people is not MISSING:
+            family.extra = dict(family.extra or {}, people=people)
+
+        rels = data.get('relationships', MISSING)
+        if isinstance(rels, list) and all(isinstance(r, dict) for r in rels):
+            ids: dict = {}
+            for row, rel in enumerate(rels):
+                style = next((i for i, (s, t) in enumerate(KEY_STYLES) if s in rel and t in rel), -1)
+                source_key, target_key = KEY_STYLES[style] if style >= 0 else (None, None)
+                if style >= 0 and isinstance(rel[source_key], str) and isinstance(rel[target_key], str):
+                    family.rel_source.append(family._id_slot(rel[source_key], ids))
+                    family.rel_target.append(family._id_slot(rel[target_key], ids))
+                else:
+                    style = -1
+                    family.rel_source.append(-1)
+                    family.rel_target.append(-1)
+                    source_key = target_key = None
+                family.rel_style.append(style + 1)
+                family.rel_types.append(_interned(rel.get('type', MISSING)))
+                skip = ('type', source_key, target_key)
+                extra = {k: v for k, v in rel.items() if k not in skip}
+                if extra:
+                    family.rel_extra[row] = extra
+        elif rels is not MISSING:
+            family.extra = dict(family.extra or {}, relationships=rels)
+        return family
+
+    @property
+    def relationships(self) -> Iterator[Relationship]:
+        ids = self.ids
+        for row, style in enumerate(self.rel_style):
+            if style:
+                source_key, target_key = KEY_STYLES[style - 1]
+                source, target = ids[self.rel_source[row]], ids[self.rel_target[row]]
+            else:
+                source_key = target_key = source = target = None
+            yield Relationship(self.rel_types[row], source, target, source_key, target_key, self.rel_extra.get(row))
+
+    def approx_size(self) -> int:
+        """Rough resident size in bytes, for cache budgeting."""
+        return 200 + 160 * len(self.people) + 40 * len(self.ids) + 24 * len(self.rel_style) + 400 * len(self.rel_extra)
+
+    def to_json(self) -> dict:
+        out: dict = {}
+        for key in self.keys:
+            if self.extra and key in self.extra:
+                out[key] = _copy(self.extra[key])
+            elif key == 'meta':
+                out[key] = _copy(self.meta)
+            elif key == 'people':
+                out[key] = [p.to_json() for p in self.people]
+            elif key == 'relationships':
+                out[key] = [r.to_json() for r in self.relationships]
+            elif key == 'events':
+                out[key] = _copy(self.events)
+        return out
+
+
+def _copy(value):
+    # Nested containers are shared with the cache; hand out copies so callers can mutate freely.
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+class Connector:
+    __slots__ = ('type', 'x1', 'y1', 'x2', 'y2')
+
+    def __init__(self, type: str, x1, y1, x2, y2):
+        self.type = type
+        self.x1 = x1
+        self.y1 = y1
+        self.x2 = x2
+        self.y2 = y2
+
+    def to_json(self) -> dict:
+        return {'type': self.type, 'x1': self.x1, 'y1': self.y1, 'x2': self.x2, 'y2': self.y2}
+
+
+def _number(value: float):
+    return int(value) if value.is_integer() else value
+
+
+class ConnectorList:
+    """Connector segments stored as one flat float array plus interned type names."""
+
+    __slots__ = ('types', 'coords')
+
+    def __init__(self):
+        self.types: list[str] = []
+        self.coords = array('d')
+
+    def append(self, type: str, x1: float, y1: float, x2: float, y2: float) -> None:
+        self.types.append(_intern(type))
+        self.coords.extend((x1, y1, x2, y2))
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    def __iter__(self) -> Iterator[Connector]:
+        c = self.coords
+        for i, type in enumerate(self.types):
+            j = i * 4
+            yield Connector(type, _number(c[j]), _number(c[j + 1]), _number(c[j + 2]), _number(c[j + 3]))
+
+    def to_json(self) -> list[dict]:
+        return [connector.to_json() for connector in self]
+
+    @classmethod
+    def from_json(cls, rows: list[dict]) -> 'ConnectorList':
+        connectors = cls()
+        for row in rows:
+            connectors.append(row['type'], row['x1'], row['y1'], row['x2'], row['y2'])
+        return connectors
+
+
+class PlacedPerson:
+    """A person card positioned by build_tree_layout()."""
+
+    __slots__ = ('id', 'name', 'years', 'photo', 'thumb', 'x', 'y', 'generation')
+
+    def __init__(self, id, name, years, photo, thumb, x, y, generation):
+        self.id = id
+        self.name = name
+        self.years = years
+        self.photo = photo
+        self.thumb = thumb
+        self.x = x
+        self.y = y
+        self.generation = generation
+
+    def to_json(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'PlacedPerson':
+        return cls(**{field: data.get(field) for field in cls.__slots__})
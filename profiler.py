@@ -0,0 +1,154 @@
+"""
+Opt-in sampling profiler for slow requests.
+
+Enable with LINEAGEMAP_PROFILE_SLOW_MS=<threshold>. A single sampler thread snapshots the
+stacks of in-flight request threads, but only once a request has been running longer than
+LINEAGEMAP_PROFILE_ARM_MS (default: a quarter of the threshold), so fast requests cost one dict
+insert/remove; until the oldest in-flight request arms, the sampler sleeps instead of polling. Requests that finish over the threshold are written as collapsed stacks
+(flamegraph.pl / speedscope compatible) to DATA_DIR/profiles, keeping the newest
+LINEAGEMAP_PROFILE_KEEP files.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from flask import Flask, g, request
+
+
+class _InFlight:
+    __slots__ = ('started', 'stacks', 'samples')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+
+
+class SlowRequestProfiler:
+    def __init__(self, out_dir: Path, threshold_ms: float, arm_ms: float | None = None,
+                 interval_ms: float = 5.0, keep: int = 50, max_depth: int = 64):
+        self.out_dir = out_dir
+        self.threshold = threshold_ms / 1000
+        self.arm = (arm_ms if arm_ms is not None else threshold_ms / 4) / 1000
+        self.interval = interval_ms / 1000
+        self.keep = keep
+        self.max_depth = max_depth
+        self._inflight: dict[int, _InFlight] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self, thread_id: int) -> None:
+        with self._lock:
+            self._inflight[thread_id] = _InFlight()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='slow-request-sampler', daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def stop(self, thread_id: int) -> _InFlight | None:
+        with self._lock:
+            return self._inflight.pop(thread_id, None)
+
+    def _run(self) -> None:
+        while True:
+            now = time.perf_counter()
+            with self._lock:
+                oldest = min((entry.started for entry in self._inflight.values()), default=None)
+                armed = {tid: entry for tid, entry in self._inflight.items() if now - entry.started >= self.arm}
+            if oldest is None:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            if not armed:
+                # Nothing has run long enough yet: sleep until the oldest request arms, not every interval.
+                time.sleep(max(oldest + self.arm - now, self.interval))
+                continue
+            frames = sys._current_frames()
+            for tid, entry in armed.items():
+                frame = frames.get(tid)
+                if frame is not None:
+                    entry.stacks[self._collapse(frame)] += 1
+                    entry.samples += 1
+            time.sleep(self.interval)
+
+    def _collapse(self, frame) -> str:
+        parts = []
+        while frame is not None and len(parts) < self.max_depth:
+            code = frame.f_code
+            parts.append(f'{Path(code.co_filename).name}:{code.co_name}:{frame.f_lineno}')
+            frame = frame.f_back
+        return ';'.join(reversed(parts))
+
+    def finish(self, thread_id: int, route: str, method: str, path: str, family_size: int | None) -> Path | None:
+        entry = self.stop(thread_id)
+        if entry is None:
+            return None
+        elapsed = time.perf_counter() - entry.started
+        if elapsed < self.threshold or not entry.samples:
+            return None
+        return self._write(entry, elapsed, route, method, path, family_size)
+
+    def _write(self, entry: _InFlight, elapsed: float, route: str, method: str, path: str,
+               family_size: int | None) -> Path:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        name = f'{datetime.now().strftime("%Y%m%d-%H%M%S-%f")}-{slug}-{int(elapsed * 1000)}ms.collapsed.txt'
+        header = [
+            f'# route: {route}',
+            f'# request: {method} {path}',
+            f'# duration_ms: {elapsed * 1000:.1f}',
+            f'# family_size: {family_size if family_size is not None else "unknown"}',
+            f'# samples: {entry.samples} every {self.interval * 1000:g}ms after {self.arm * 1000:g}ms',
+            f'# pid: {os.getpid()}',
+        ]
+        body = [f'{stack} {count}' for stack, count in entry.stacks.most_common()]
+        target = self.out_dir / name
+        target.write_text('\n'.join(header + body) + '\n', encoding='utf-8')
+        self._rotate()
+        return target
+
+    def _rotate(self) -> None:
+        profiles = sorted(self.out_dir.glob('*.collapsed.txt'))
+        for old in profiles[:-self.keep] if self.keep > 0 else []:
+            old.unlink(missing_ok=True)
+
+
+def attach_slow_request_profiler(app: Flask, data_dir: Path) -> SlowRequestProfiler | None:
+    """Install the profiler on ``app`` when LINEAGEMAP_PROFILE_SLOW_MS is set; otherwise do nothing."""
+    threshold = float(os.environ.get('LINEAGEMAP_PROFILE_SLOW_MS', '0') or 0)
+    if threshold <= 0:
+        return None
+    arm = os.environ.get('LINEAGEMAP_PROFILE_ARM_MS')
+    profiler = SlowRequestProfiler(
+        data_dir / 'profiles',
+        threshold_ms=threshold,
+        arm_ms=float(arm) if arm else None,
+        interval_ms=float(os.environ.get('LINEAGEMAP_PROFILE_INTERVAL_MS', '5')),
+        keep=int(os.environ.get('LINEAGEMAP_PROFILE_KEEP', '50')),
+    )
+
+    @app.before_request
+    def _profile_start():
+        profiler.start(threading.get_ident())
+
+    @app.teardown_request
+    def _profile_finish(exc):
+        rule = request.url_rule
+        profiler.finish(
+            threading.get_ident(),
+            route=rule.rule if rule is not None else 'unmatched',
+            method=request.method,
+            path=request.full_path.rstrip('?'),
+            family_size=g.get('family_size'),
+        )
+
+    return profiler
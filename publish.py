@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import fcntl
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+log = logging.getLogger(__name__)
+
+# Extensions that get a precompressed .gz sibling for gzip_static-style serving.
+COMPRESSIBLE = {'.html', '.json', '.css', '.js', '.svg'}
+
+
+def write_snapshot(target: Path, files: dict[str, str | bytes]) -> None:
+    """Write a snapshot into a staging dir, then swap it in so readers never see a partial tree.
+
+    Publishes of the same target are serialized on a lock file next to it (workers and the
+    republish command may race), and the staging dir is removed if anything fails.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    suffix = f'{os.getpid()}.{threading.get_ident()}'
+    staging = target.with_name(f'.{target.name}.{suffix}.tmp')
+    retired = target.with_name(f'.{target.name}.{suffix}.old')
+    with open(target.with_name(f'.{target.name}.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            shutil.rmtree(staging, ignore_errors=True)
+            staging.mkdir(parents=True)
+            for name, content in files.items():
+                body = content.encode('utf-8') if isinstance(content, str) else content
+                dst = staging / name
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                dst.write_bytes(body)
+                if dst.suffix in COMPRESSIBLE:
+                    with gzip.open(dst.with_name(dst.name + '.gz'), 'wb', compresslevel=9) as f:
+                        f.write(body)
+
+            if target.exists():
+                os.replace(target, retired)
+            try:
+                os.replace(staging, target)
+            except OSError:
+                if retired.exists():
+                    os.replace(retired, target)
+                raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+            shutil.rmtree(retired, ignore_errors=True)
+
+
+def remove_snapshot(target: Path) -> None:
+    if not target.exists():
+        return
+    with open(target.with_name(f'.{target.name}.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        shutil.rmtree(target, ignore_errors=True)
+
+
+class Publisher:
+    """Rebuilds public snapshots on a background thread, coalescing bursts of edits per key.
+
+    ``build(key)`` returns ``(target_dir, files)`` to publish, or ``(target_dir, None)``
+    when the snapshot should be withdrawn.
+    """
+
+    def __init__(self, build: Callable[[str], tuple[Path, dict[str, str | bytes] | None]], delay: float = 0.5):
+        self.build = build
+        self.delay = delay
+        self._pending: dict[str, float] = {}
+        self._cond = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def schedule(self, key: str) -> None:
+        with self._cond:
+            self._pending[key] = time.monotonic() + self.delay
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='snapshot-publisher', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def publish_now(self, key: str) -> None:
+        with self._cond:
+            self._pending.pop(key, None)
+        self._publish(key)
+
+    def _publish(self, key: str) -> None:
+        try:
+            target, files = self.build(key)
+            if files is None:
+                remove_snapshot(target)
+            else:
+                write_snapshot(target, files)
+        except Exception:
+            log.exception('snapshot publish failed for %s', key)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                key, due = min(self._pending.items(), key=lambda item: item[1])
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                del self._pending[key]
+            self._publish(key)
@@ -0,0 +1,167 @@
+// static/js/familySync.js
+// Client cache contract for family JSON (tree.js, timeline.js, map.js).
+//
+// Endpoints that support delta sync answer with two headers:
+//   X-Family-Version: <n>        monotonic per-family version of the returned data
+//   X-Family-Changes: <url>      GET <url>?since=<n> returns only what changed after version n
+// The client keeps { version, changesUrl, data } in localStorage per endpoint URL and on the next
+// load asks the changes URL instead of downloading the whole family:
+//   304                          nothing changed, use the cached copy
+//   { full: true, family }       history too old or unknown: replace the cache
+//   { full: false, version, people|relationships|events: { added, changed, removed, added_ids, changed_ids },
+//     changed_keys }
+// Items are matched by identity (people/events by id, relationships by type + endpoints); repeated
+// identities get an occurrence suffix ("<id>#2", history.indexed()) so duplicate rows stay distinct.
+// Added/changed items are upserted, so applying the same delta twice is harmless.
+// Endpoints without the headers (samples, public snapshots) are fetched normally and not cached.
+// Cached families are personal data: they are cleared when a logout link is followed (and /logout
+// also answers with Clear-Site-Data: "storage" for browsers that honour it).
+
+(() => {
+  const PREFIX = "lineagemap:family:";
+  const KEY_STYLES = [["a", "b"], ["parent", "child"], ["parentId", "childId"], ["source", "target"], ["sourceId", "targetId"]];
+  const COLLECTIONS = ["people", "relationships", "events"];
+
+  function identity(collection, item) {
+    if (!item || typeof item !== "object") return null;
+    if (collection === "relationships") {
+      for (const [s, t] of KEY_STYLES) {
+        if (s in item && t in item) return `${item.type ?? ""}:${s}=${item[s]}|${t}=${item[t]}`;
+      }
+      return null;
+    }
+    return typeof item.id === "string" ? item.id : null;
+  }
+
+  function indexedIds(collection, items) {
+    const seen = new Map();
+    return items.map((item) => {
+      const id = identity(collection, item);
+      if (id === null) return null;
+      const n = (seen.get(id) || 0) + 1;
+      seen.set(id, n);
+      return n === 1 ? id : `${id}#${n}`;
+    });
+  }
+
+  function applyDelta(family, delta) {
+    const out = { ...family };
+    for (const collection of COLLECTIONS) {
+      const change = delta[collection];
+      if (!change) continue;
+      const removed = new Set(change.removed || []);
+      const incoming = new Map();
+      const anonymous = [];
+      for (const field of ["added", "changed"]) {
+        const items = change[field] || [];
+        const ids = change[`${field}_ids`] || indexedIds(collection, items);
+        items.forEach((item, i) => {
+          const id = ids[i];
+          if (id === null || id === undefined || id.startsWith("#")) anonymous.push(item);
+          else incoming.set(id, item);
+        });
+      }
+      const current = out[collection] || [];
+      const currentIds = indexedIds(collection, current);
+      const items = [];
+      for (const [i, item] of current.entries()) {
+        const id = currentIds[i];
+        if (id !== null && removed.has(id)) continue;
+        if (id !== null && incoming.has(id)) {
+          items.push(incoming.get(id));
+          incoming.delete(id);
+        } else {
+          items.push(item);
+        }
+      }
+      items.push(...incoming.values(), ...anonymous);
+      out[collection] = items;
+    }
+    for (const [key, value] of Object.entries(delta.changed_keys || {})) {
+      if (value === null) delete out[key];
+      else out[key] = value;
+    }
+    return out;
+  }
+
+  function readCache(url) {
+    try {
+      return JSON.parse(localStorage.getItem(PREFIX + url) || "null");
+    } catch {
+      return null;
+    }
+  }
+
+  function dropCache(url) {
+    try { localStorage.removeItem(PREFIX + url); } catch { /* ignore */ }
+  }
+
+  function writeCache(url, entry) {
+    try {
+      localStorage.setItem(PREFIX + url, JSON.stringify(entry));
+    } catch {
+      // Quota exceeded or storage disabled: fall back to full downloads.
+      dropCache(url);
+    }
+  }
+
+  async function fetchFull(url) {
+    const res = await fetch(url, { headers: { accept: "application/json" }, credentials: "same-origin" });
+    if (!res.ok) throw new Error(`${res.status} ${res.statusText}`);
+    const data = await res.json();
+    const version = res.headers.get("X-Family-Version");
+    const changesUrl = res.headers.get("X-Family-Changes");
+    if (version !== null && changesUrl) {
+      writeCache(url, { version: Number(version), changesUrl, data });
+    }
+    return data;
+  }
+
+  async function fetchFamilyJson(url) {
+    const cached = readCache(url);
+    if (!cached) return fetchFull(url);
+
+    const sep = cached.changesUrl.includes("?") ? "&" : "?";
+    const res = await fetch(`${cached.changesUrl}${sep}since=${cached.version}`, {
+      headers: { accept: "application/json" },
+      credentials: "same-origin",
+    });
+    if (res.status === 304) return cached.data;
+    if (!res.ok) return fetchFull(url);
+
+    // The changes response names the family it describes; after a sign-in as another account it
+    // differs from the cached one, and the entry must follow it rather than keep the old URL.
+    const delta = await res.json();
+    const changesUrl = res.headers.get("X-Family-Changes");
+    const version = Number(res.headers.get("X-Family-Version") ?? delta.version);
+    if (delta.full) {
+      if (changesUrl) writeCache(url, { version, changesUrl, data: delta.family });
+      else dropCache(url);
+      return delta.family;
+    }
+    if (!changesUrl || changesUrl !== cached.changesUrl) {
+      // Never patch one family's cached copy with another family's delta.
+      dropCache(url);
+      return fetchFull(url);
+    }
+    const data = applyDelta(cached.data, delta);
+    writeCache(url, { version, changesUrl, data });
+    return data;
+  }
+
+  function clearFamilyCache() {
+    try {
+      for (const key of Object.keys(localStorage)) {
+        if (key.startsWith(PREFIX)) localStorage.removeItem(key);
+      }
+    } catch { /* storage disabled */ }
+  }
+
+  document.addEventListener("click", (event) => {
+    const link = event.target instanceof Element ? event.target.closest("a[href]") : null;
+    if (link && new URL(link.href, location.href).pathname === "/logout") clearFamilyCache();
+  });
+
+  window.fetchFamilyJson = fetchFamilyJson;
+  window.clearFamilyCache = clearFamilyCache;
+})();
@@ -259,6 +259,7 @@ async function boot() {
 
 async function fetchPeople() {
   const url = window.MAP_API_URL;
+  if (window.fetchFamilyJson) return window.fetchFamilyJson(url);
   const res = await fetch(url, { credentials: "same-origin" });
   if (!res.ok) throw new Error(`Map data fetch failed (${res.status})`);
   return await res.json();
@@ -529,9 +529,14 @@
     try {
       setStatus("Loading timeline…");
       const url = apiUrl ? apiUrl : `/api/tree/${familyId}`;
-      const r = await fetch(url, { headers: { "Accept": "application/json" } });
-      if (!r.ok) throw new Error(`${r.status} ${r.statusText}`);
-      const tree = await r.json();
+      let tree;
+      if (window.fetchFamilyJson) {
+        tree = await window.fetchFamilyJson(url);
+      } else {
+        const r = await fetch(url, { headers: { "Accept": "application/json" } });
+        if (!r.ok) throw new Error(`${r.status} ${r.statusText}`);
+        tree = await r.json();
+      }
       allEvents = buildEvents(tree);
       render();
     } catch (err) {
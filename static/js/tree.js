@@ -760,6 +760,8 @@ function buildScene(treeJson, previewMode) {
 async function fetchTreeJson() {
   const url = window.TREE_API_URL;
   if (!url) throw new Error("TREE_API_URL is not set");
+  // familySync.js (when loaded) serves a cached copy and fetches only changes since its version.
+  if (window.fetchFamilyJson) return window.fetchFamilyJson(url);
   const res = await fetch(url, { headers: { accept: "application/json" } });
   if (!res.ok) throw new Error(`Tree API ${res.status} ${res.statusText}`);
   return res.json();
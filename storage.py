@@ -0,0 +1,122 @@
+"""
+Filesystem helpers shared by app.py and app_old.py.
+
+Directory creation is remembered per process so hot paths never repeat mkdir syscalls, and an
+init marker in DATA_DIR lets freshly spawned workers skip one-time setup another process already did.
+
+Per-user files are spread over hashed fan-out directories (root/ab/cd/<entry>, from the SHA-1 of
+the user key) so no single directory grows past a few entries per 65k users. shard_dir() is a
+pure computation; migrate_to_shards() moves a flat legacy directory into that layout in bulk.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Callable
+
+INIT_MARKER = '.lineagemap-init'
+LAYOUT_MARKER = '.layout'
+SHARD_LAYOUT = 'sha1-2-2'
+_STAGING = '.unsharded'
+_STAGED = '.staged'
+_MIGRATE_LOCK = '.migrate.lock'
+
+_ready_dirs: set[str] = set()
+_ready_lock = threading.Lock()
+
+
+def ensure_dir(path: Path) -> Path:
+    key = str(path)
+    if key not in _ready_dirs:
+        path.mkdir(parents=True, exist_ok=True)
+        with _ready_lock:
+            _ready_dirs.add(key)
+    return path
+
+
+def mark_dirs_ready(*paths: Path) -> None:
+    with _ready_lock:
+        _ready_dirs.update(str(p) for p in paths)
+
+
+def _read_marker(path: Path) -> str | None:
+    try:
+        return path.read_text(encoding='utf-8').strip()
+    except OSError:
+        return None
+
+
+def init_marker_matches(data_dir: Path, name: str, schema: str) -> bool:
+    return _read_marker(data_dir / f'{INIT_MARKER}-{name}') == schema
+
+
+def write_init_marker(data_dir: Path, name: str, schema: str) -> None:
+    (data_dir / f'{INIT_MARKER}-{name}').write_text(schema + '\n', encoding='utf-8')
+
+
+def shard_dir(root: Path, key: str) -> Path:
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return root / digest[:2] / digest[2:4]
+
+
+def is_sharded(root: Path) -> bool:
+    return _read_marker(root / LAYOUT_MARKER) == SHARD_LAYOUT
+
+
+def _is_shard(path: Path) -> bool:
+    """True for an existing fan-out directory (ab/ holding cd/ subdirectories), e.g. after .layout was lost."""
+    if len(path.name) != 2 or not all(c in '0123456789abcdef' for c in path.name) or not path.is_dir():
+        return False
+    with os.scandir(path) as entries:
+        return any(e.is_dir() and len(e.name) == 2 and all(c in '0123456789abcdef' for c in e.name) for e in entries)
+
+
+def migrate_to_shards(root: Path, key_of: Callable[[str], str | None]) -> int:
+    """
+    Move every flat entry of ``root`` to shard_dir(root, key_of(name)) / name and mark root as sharded.
+
+    Entries are first renamed into a staging directory, so legacy names that look like shard
+    directories (e.g. user id "12") cannot collide with the new layout. Each step is an
+    os.replace() on the same filesystem; rerunning after an interruption resumes where it stopped.
+    Entries for which key_of() returns None, and existing shard directories (a sharded root whose
+    .layout marker was lost, e.g. restored without dotfiles), are left in place. Returns the number
+    of entries moved.
+
+    The whole migration holds an exclusive flock on root/.migrate.lock, so workers that start
+    together (or `migrate-storage` next to a running server) never move entries under each other.
+    """
+    if is_sharded(root) or not root.is_dir():
+        return 0
+    with open(root / _MIGRATE_LOCK, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if is_sharded(root):
+            return 0
+        return _migrate_locked(root, key_of)
+
+
+def _migrate_locked(root: Path, key_of: Callable[[str], str | None]) -> int:
+    staging = root / _STAGING
+    if not (staging / _STAGED).exists():
+        staging.mkdir(exist_ok=True)
+        with os.scandir(root) as entries:
+            names = [e.name for e in entries
+                     if not e.name.startswith('.') and not _is_shard(root / e.name) and key_of(e.name) is not None]
+        for name in names:
+            os.replace(root / name, staging / name)
+        (staging / _STAGED).touch()
+
+    moved = 0
+    with os.scandir(staging) as entries:
+        names = [e.name for e in entries if e.name != _STAGED]
+    for name in names:
+        target = ensure_dir(shard_dir(root, key_of(name))) / name
+        os.replace(staging / name, target)
+        moved += 1
+    (staging / _STAGED).unlink()
+    staging.rmdir()
+    (root / LAYOUT_MARKER).write_text(SHARD_LAYOUT + '\n', encoding='utf-8')
+    return moved